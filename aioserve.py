@@ -0,0 +1,365 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from werkzeug.test import EnvironBuilder
+from werkzeug.test import run_wsgi_app
+import upstream
+import metrics
+
+# asyncio serving mode
+# Serves the route table of the Flask app on an aiohttp server. Proxy routes
+# are forwarded on an async client, so a slow Market Maker call no longer pins
+# a thread; every other route (MINT, stats) runs the Flask view on a thread pool.
+
+def failure(e):
+	"""
+	upstream.UpstreamFailure for an aiohttp timeout or connection error.
+	"""
+	if isinstance(e, asyncio.TimeoutError):
+		return upstream.UpstreamFailure('Market Maker timed out: %s' % e.__class__.__name__, 504)
+	return upstream.UpstreamFailure('Market Maker is unreachable: %s' % e.__class__.__name__, 503)
+
+class AsyncSingleFlight(object):
+	"""
+	The event loop counterpart of upstream.SingleFlight.
+	"""
+
+	def __init__(self):
+		self.calls = {}
+		self.leaders = 0
+		self.followers = 0
+
+	async def do(self, key, fn):
+		future = self.calls.get(key)
+		if future is not None:
+			self.followers += 1
+			return await asyncio.shield(future)
+		self.leaders += 1
+		future = asyncio.get_running_loop().create_future()
+		self.calls[key] = future
+		try:
+			result = await fn()
+			future.set_result(result)
+			return result
+		except Exception as e:
+			future.set_exception(e)
+			# retrieve it so an exception nobody else waited on is not logged
+			future.exception()
+			raise
+		finally:
+			del self.calls[key]
+
+	def stats(self):
+		return {
+			"in_flight": len(self.calls),
+			"upstream_calls": self.leaders,
+			"coalesced": self.followers
+		}
+
+class AsyncProxy(object):
+
+	def __init__(self, app, config, market_maker, response_cache, proxy_endpoints, cached_endpoints, compressor, server_timing=True):
+		self.app = app
+		self.server_timing = server_timing
+		self.compressor = compressor
+		self.market_maker = market_maker
+		self.response_cache = response_cache
+		self.proxy_endpoints = proxy_endpoints
+		self.cached_endpoints = cached_endpoints
+		self.max_in_flight = config.get('max_in_flight', 2000)
+		self.connections = config.get('connections', 256)
+		self.executor = ThreadPoolExecutor(max_workers=config.get('threads', 16))
+		self.in_flight = AsyncSingleFlight()
+
+	async def start(self, application):
+		self.semaphore = asyncio.Semaphore(self.max_in_flight)
+		self.bulkheads = dict((name, asyncio.Semaphore(limit)) for name, limit in self.market_maker.bulkheads.limits.items())
+		self.connector = aiohttp.TCPConnector(limit=self.connections, limit_per_host=self.connections)
+		timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.market_maker.connect_timeout, sock_read=self.market_maker.read_timeout)
+		# buffered bodies are fetched uncompressed, as upstream.MarketMaker does
+		self.session = aiohttp.ClientSession(connector=self.connector, connector_owner=False, timeout=timeout, headers={'Accept-Encoding': 'identity'})
+		# streamed bodies are relayed still encoded, like the threaded engine does
+		self.raw_session = aiohttp.ClientSession(connector=self.connector, connector_owner=False, auto_decompress=False, timeout=timeout)
+
+	async def stop(self, application):
+		await self.session.close()
+		await self.raw_session.close()
+		await self.connector.close()
+		self.executor.shutdown(wait=False)
+
+	def application(self):
+		application = web.Application(middlewares=[self.recordMetrics])
+		for rule in self.app.url_map.iter_rules():
+			if rule.endpoint == 'static':
+				continue
+			path = rule.rule.replace('<', '{').replace('>', '}')
+			if rule.endpoint in self.proxy_endpoints:
+				handler = self.proxy
+			else:
+				handler = self.wsgi
+			for method in sorted(rule.methods - set(['HEAD', 'OPTIONS'])):
+				if method == 'GET':
+					# answers HEAD too, as Flask does
+					application.router.add_get(path, handler, name='%s.%s' % (rule.endpoint, method), allow_head=True)
+				else:
+					application.router.add_route(method, path, handler, name='%s.%s' % (rule.endpoint, method))
+		application.on_startup.append(self.start)
+		application.on_cleanup.append(self.stop)
+		return application
+
+	def endpoint(self, request):
+		return request.match_info.route.name.rsplit('.', 1)[0]
+
+	@web.middleware
+	async def recordMetrics(self, request, handler):
+		"""
+		Per route metrics and Server-Timing of the proxied routes; the Flask
+		app records its own.
+		"""
+		if handler != self.proxy:
+			return await handler(request)
+		route = self.endpoint(request)
+		started = request['started'] = time.perf_counter()
+		request['timings'] = metrics.startTimings()
+		status = 500
+		try:
+			response = await handler(request)
+			status = response.status
+			if self.server_timing and not response.prepared:
+				response.headers['Server-Timing'] = metrics.serverTiming(request['timings'], time.perf_counter() - started)
+			return response
+		finally:
+			metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+			metrics.REQUESTS.inc(route, request.method, str(status))
+			if status >= 500:
+				metrics.REQUEST_ERRORS.inc(route)
+
+	@contextlib.asynccontextmanager
+	async def slot(self):
+		"""
+		Hold one of the ``max_in_flight`` upstream slots, the wait for it
+		counting as queue time.
+		"""
+		waited = time.perf_counter()
+		async with self.semaphore:
+			metrics.addTiming('queue', time.perf_counter() - waited)
+			yield
+
+	@contextlib.asynccontextmanager
+	async def bulkhead(self, method, full_path):
+		"""
+		Hold a slot of the route class of a call, like
+		upstream.MarketMaker.request does.
+		"""
+		route_class = upstream.routeClass(method, full_path)
+		slots = self.bulkheads.get(route_class)
+		if slots is None:
+			yield route_class
+			return
+		try:
+			await asyncio.wait_for(slots.acquire(), self.market_maker.bulkheads.wait)
+		except asyncio.TimeoutError:
+			raise self.market_maker.bulkheads.refuse(route_class)
+		self.market_maker.bulkheads.count(route_class, 1)
+		try:
+			yield route_class
+		finally:
+			self.market_maker.bulkheads.count(route_class, -1)
+			slots.release()
+
+	async def openUpstream(self, session, backend, method, full_path, body, headers):
+		"""
+		Open a Market Maker request to ``backend`` on ``session``, timed up to
+		the response headers like upstream.MarketMaker.send.
+		"""
+		resource = upstream.resourceOf(full_path)
+		backend.started()
+		started = time.perf_counter()
+		try:
+			response = await session.request(method, backend.url + full_path, data=body, headers=headers)
+		except asyncio.CancelledError:
+			# the slower half of a hedged GET, cancelled before its headers
+			self.market_maker.responded(backend, time.perf_counter() - started, None)
+			raise
+		except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+			self.market_maker.failed(backend, method, resource, started)
+			raise failure(e)
+		except Exception:
+			self.market_maker.failed(backend, method, resource, started)
+			raise
+		finally:
+			elapsed = time.perf_counter() - started
+			metrics.UPSTREAM_SECONDS.observe(elapsed, method, resource)
+			metrics.addTiming('upstream', elapsed)
+		self.market_maker.responded(backend, elapsed, backend.breaker.healthy(response.status))
+		if response.status >= 500:
+			metrics.UPSTREAM_ERRORS.inc(method, resource)
+		return response
+
+	async def fetchFrom(self, backend, method, full_path, body, headers):
+		"""
+		Buffered call to ``backend``, returning ``(content, status, headers)``.
+		"""
+		response = await self.openUpstream(self.session, backend, method, full_path, body, headers)
+		try:
+			async with response:
+				content = await response.read()
+		except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+			raise failure(e)
+		return (content, response.status, upstream.forwardHeaders(response))
+
+	async def hedgedGet(self, route_class, full_path, headers):
+		"""
+		The event loop counterpart of upstream.MarketMaker.hedgedGet; the slower
+		call is cancelled.
+		"""
+		primary = self.market_maker.pick(route_class)
+		delay = self.market_maker.hedgeDelay()
+		if delay is None:
+			return await self.fetchFrom(primary, 'GET', full_path, None, headers)
+		loop = asyncio.get_running_loop()
+		started = time.perf_counter()
+		# in an empty context, so their time is added once, below
+		first = contextvars.Context().run(loop.create_task, self.fetchFrom(primary, 'GET', full_path, None, headers))
+		pending = set([first])
+		try:
+			# a call that failed early is hedged at once
+			done, pending = await asyncio.wait(pending, timeout=delay)
+			if done and first.exception() is None and first.result()[1] < 500:
+				return first.result()
+			backend = self.market_maker.pickHedge(route_class, primary)
+			if backend is None:
+				return await first
+			second = contextvars.Context().run(loop.create_task, self.fetchFrom(backend, 'GET', full_path, None, headers))
+			pending = set([first, second])
+			while pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in done:
+					if task.exception() is None and task.result()[1] < 500:
+						if task is second:
+							self.market_maker.hedgeWon()
+						else:
+							metrics.UPSTREAM_HEDGES.inc('primary')
+						return task.result()
+			return first.result()
+		finally:
+			for task in pending:
+				task.cancel()
+			metrics.addTiming('upstream', time.perf_counter() - started)
+
+	async def proxy(self, request):
+		try:
+			return await self.forward(request)
+		except upstream.UpstreamError as e:
+			content, status, headers = e.response()
+			return web.Response(body=content, status=status, headers=headers)
+
+	async def forward(self, request):
+		endpoint = self.endpoint(request)
+		query_string, fields = upstream.splitFields(request.query_string)
+		# same cache key as flask.Request.full_path, or the path qaapi.proxy
+		# fetches when fields are projected
+		full_path = request.path + '?' + query_string
+		resource = self.cached_endpoints.get(endpoint)
+		# like qaapi.fetchUpstream, a buffered HEAD is fetched as a GET and never stored
+		head = request.method == 'HEAD'
+		method = 'GET' if head else request.method
+		if resource is not None and method == 'GET':
+			cached = self.response_cache.get(full_path)
+			if cached is not None:
+				return await self.buffered(request, cached, fields)
+		# like the threaded engine, only a JSON body is forwarded
+		body = None
+		headers = {}
+		if request.content_type == 'application/json' and request.can_read_body:
+			body = await request.read()
+			headers['Content-Type'] = 'application/json'
+		if endpoint in self.market_maker.stream_endpoints and not fields:
+			headers['Accept-Encoding'] = request.headers.get('Accept-Encoding', 'identity')
+			return await self.stream(request, full_path, body, headers)
+
+		async def fetch():
+			async with self.slot(), self.bulkhead(method, full_path) as route_class:
+				if method == 'GET' and self.market_maker.hedge:
+					result = await self.hedgedGet(route_class, full_path, headers)
+				else:
+					backend = self.market_maker.pick(route_class)
+					try:
+						result = await self.fetchFrom(backend, method, full_path, body, headers)
+					except upstream.UpstreamFailure as e:
+						other = self.market_maker.failover(method, route_class, backend, e)
+						if other is None:
+							raise
+						result = await self.fetchFrom(other, method, full_path, body, headers)
+			if resource is not None and not head and result[1] == 200:
+				result = upstream.withEtag(result)
+				self.response_cache.set(full_path, resource, result)
+			return result
+
+		if method == 'GET' and not head and self.market_maker.coalesce:
+			return await self.buffered(request, await self.in_flight.do(full_path, fetch), fields)
+		return await self.buffered(request, await fetch(), fields)
+
+	async def stream(self, request, full_path, body, headers):
+		# like the threaded engine, the route class slot is held until the body is relayed
+		async with self.slot(), self.bulkhead(request.method, full_path) as route_class:
+			response = await self.openUpstream(self.raw_session, self.market_maker.pick(route_class), request.method, full_path, body, headers)
+			async with response:
+				relay = web.StreamResponse(status=response.status, headers=upstream.forwardHeaders(response, encoded=True))
+				if self.server_timing:
+					# the headers go out before the body, so this covers up to the first byte
+					relay.headers['Server-Timing'] = metrics.serverTiming(request['timings'], time.perf_counter() - request['started'])
+				await relay.prepare(request)
+				async for chunk in response.content.iter_chunked(self.market_maker.chunk_size):
+					await relay.write(chunk)
+				await relay.write_eof()
+				return relay
+
+	async def buffered(self, request, result, fields=None):
+		if fields:
+			result = upstream.projectResult(result, fields)
+		if request.method in upstream.READ_METHODS and result[1] == 200:
+			result = upstream.withEtag(result)
+			etag = upstream.etagOf(result[2])
+			if upstream.notModified(request.headers.get('If-None-Match'), etag):
+				return web.Response(status=304, headers=[('ETag', etag)])
+		content, status, headers = result
+		content_type = dict((name.lower(), value) for name, value in headers).get('content-type', '')
+		if self.compressor.compressible(content_type, len(content)):
+			headers = list(headers) + [('Vary', 'Accept-Encoding')]
+			encoding = self.compressor.negotiate(request.headers.get('Accept-Encoding'))
+			if encoding is not None:
+				# off the event loop, large bodies take milliseconds to compress
+				loop = asyncio.get_running_loop()
+				# in this request's context, for its serialize timing
+				content = await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.compressor.compress, content, encoding)
+				headers.append(('Content-Encoding', encoding))
+		return web.Response(body=content, status=status, headers=headers)
+
+	async def wsgi(self, request):
+		body = await request.read()
+		builder = EnvironBuilder(
+			path=request.path,
+			method=request.method,
+			query_string=request.query_string,
+			headers=list(request.headers.items()),
+			data=body)
+		environ = builder.get_environ()
+		builder.close()
+		loop = asyncio.get_running_loop()
+		app_iter, status, headers = await loop.run_in_executor(self.executor, self.callApp, environ, time.perf_counter())
+		headers = [(name, value) for name, value in headers.items() if name.lower() != 'content-length']
+		return web.Response(body=app_iter, status=int(status.split(' ', 1)[0]), headers=headers)
+
+	def callApp(self, environ, submitted):
+		# read by the Flask app as queue time for its Server-Timing header
+		environ['qaapi.queue_seconds'] = time.perf_counter() - submitted
+		app_iter, status, headers = run_wsgi_app(self.app.wsgi_app, environ, buffered=True)
+		return (b''.join(app_iter), status, headers)
+
+def run(engine, host, port):
+	web.run_app(engine.application(), host=host, port=port)
@@ -0,0 +1,154 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Load driver
+# Closed loop: each of ``concurrency`` workers holds one keep-alive connection
+# and sends its next request as soon as the previous one is answered, cycling
+# through the routes. Reports latency percentiles and throughput per route.
+
+# proxied reads a polling bot makes, hottest first
+DEFAULT_ROUTES = [
+	'/sports',
+	'/sports/1.16.1/eventGroups',
+	'/eventGroups/1.17.1/events',
+	'/events/1.18.1/bettingMarketGroups',
+	'/bettingMarketGroups/1.20.1/bettingMarkets',
+	'/bettingMarkets/1.21.1',
+	'/bettors/bench/accountDetails',
+	'/bettors/bench/unmatchedBets'
+]
+
+def percentile(ordered, fraction):
+	if not ordered:
+		return 0.0
+	index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+	return ordered[index]
+
+def summarize(latencies, errors, elapsed):
+	ordered = sorted(latencies)
+	return {
+		"requests": len(ordered),
+		"errors": errors,
+		"rps": len(ordered) / elapsed if elapsed > 0 else 0.0,
+		"p50_ms": percentile(ordered, 0.50) * 1000,
+		"p95_ms": percentile(ordered, 0.95) * 1000,
+		"p99_ms": percentile(ordered, 0.99) * 1000,
+		"max_ms": (ordered[-1] if ordered else 0.0) * 1000
+	}
+
+class Worker(threading.Thread):
+
+	def __init__(self, url, routes, offset, headers, until, warmup_until):
+		threading.Thread.__init__(self, name='load-%d' % offset)
+		self.daemon = True
+		parts = urlsplit(url)
+		self.host = parts.hostname
+		self.port = parts.port or 80
+		self.routes = routes
+		self.offset = offset
+		self.headers = headers
+		self.until = until
+		self.warmup_until = warmup_until
+		self.latencies = dict((route, []) for route in routes)
+		self.errors = dict((route, 0) for route in routes)
+
+	def connect(self):
+		return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+	def run(self):
+		connection = self.connect()
+		index = self.offset
+		while True:
+			started = time.perf_counter()
+			if started >= self.until:
+				break
+			route = self.routes[index % len(self.routes)]
+			index += 1
+			try:
+				connection.request('GET', route, headers=self.headers)
+				response = connection.getresponse()
+				response.read()
+				failed = response.status >= 500
+			except (OSError, http.client.HTTPException):
+				connection.close()
+				connection = self.connect()
+				failed = True
+			finished = time.perf_counter()
+			if started < self.warmup_until:
+				continue
+			if failed:
+				self.errors[route] += 1
+			else:
+				self.latencies[route].append(finished - started)
+		connection.close()
+
+def run(url, routes=None, concurrency=16, duration=10.0, warmup=2.0, headers=None):
+	"""
+	Drive ``routes`` on the qaapi at ``url`` for ``warmup`` plus ``duration``
+	seconds and return the summary of the measured part, overall and per route.
+	"""
+	routes = routes or DEFAULT_ROUTES
+	start = time.perf_counter()
+	warmup_until = start + warmup
+	until = warmup_until + duration
+	workers = [Worker(url, routes, offset, headers or {}, until, warmup_until) for offset in range(concurrency)]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	elapsed = time.perf_counter() - warmup_until
+	result = {"concurrency": concurrency, "duration": elapsed, "routes": {}}
+	everything = []
+	errors = 0
+	for route in routes:
+		latencies = [value for worker in workers for value in worker.latencies[route]]
+		route_errors = sum(worker.errors[route] for worker in workers)
+		result["routes"][route] = summarize(latencies, route_errors, elapsed)
+		everything.extend(latencies)
+		errors += route_errors
+	result["total"] = summarize(everything, errors, elapsed)
+	return result
+
+def report(result):
+	lines = ['%-44s %8s %6s %9s %9s %9s %9s %9s' % ('route', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+	rows = list(result["routes"].items()) + [('total', result["total"])]
+	for route, row in rows:
+		lines.append('%-44s %8d %6d %9.1f %9.2f %9.2f %9.2f %9.2f' % (
+			route, row["requests"], row["errors"], row["rps"], row["p50_ms"], row["p95_ms"], row["p99_ms"], row["max_ms"]))
+	return '\n'.join(lines)
+
+def regressions(result, baseline, tolerance):
+	"""
+	Routes whose p95 latency or throughput is worse than in ``baseline`` by
+	more than ``tolerance`` (0.2 for 20%).
+	"""
+	found = []
+	for route, row in list(result["routes"].items()) + [('total', result["total"])]:
+		before = baseline["total"] if route == 'total' else baseline["routes"].get(route)
+		if before is None:
+			continue
+		if before["p95_ms"] > 0 and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+			found.append('%s: p95 %.2f ms, was %.2f ms' % (route, row["p95_ms"], before["p95_ms"]))
+		if row["rps"] < before["rps"] * (1 - tolerance):
+			found.append('%s: %.1f rps, was %.1f rps' % (route, row["rps"], before["rps"]))
+	return found
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Drive a running qaapi and report latency percentiles')
+	parser.add_argument('url', help='qaapi base url, e.g. http://127.0.0.1:5050')
+	parser.add_argument('--concurrency', type=int, default=16)
+	parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+	parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before that')
+	parser.add_argument('--route', action='append', dest='routes', help='route to drive, repeatable; defaults to the proxied reads')
+	parser.add_argument('--gzip', action='store_true', help='send Accept-Encoding: gzip')
+	parser.add_argument('--json', help='also write the results to this file')
+	args = parser.parse_args()
+	result = run(args.url, args.routes, args.concurrency, args.duration, args.warmup, {'Accept-Encoding': 'gzip'} if args.gzip else None)
+	print(report(result))
+	if args.json:
+		with open(args.json, 'w') as output:
+			json.dump(result, output, indent=2)
@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+import yaml
+
+# MINT benchmark
+# Runs the MINT operations of a full market lifecycle through mint.py against
+# the in-memory chain simulator: create a sport and event group, then per
+# event a betting market group with two markets, approve, close and resolve.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chainsim
+import mint
+
+def lifecycle(chain, events, batch_max_ops):
+	"""
+	Returns the number of operations broadcast.
+	"""
+	operations = 0
+	account = mint.node().getSelectedAccountName()
+
+	def approveAll():
+		open_ids = [proposal['id'] for proposal in mint.getProposals(account)]
+		mint.approveProposals(open_ids, True, batch_max_ops)
+
+	mint.propose([
+		('createSport', ([["en", "Bench"]],)),
+		('createEventGroup', ([["en", "Bench league"]], '0.0.0'))
+	])
+	operations += 2
+	approveAll()
+	event_group = [object_id for object_id in chain.objects if object_id.startswith('1.17.')][-1]
+
+	start_time = datetime(2030, 1, 1, 12, 0, 0)
+	for index in range(events):
+		mint.propose([
+			('createEvent', ([["en", "Home %d v Away %d" % (index, index)]], [["en", "2030"]], start_time, event_group)),
+			('createBettingMarketGroup', ([["en", "Moneyline"]], '0.0.0', '1.19.0', 'BTF')),
+			('createBettingMarket', ([["en", "Home"]], [["en", "Home"]], '0.0.1')),
+			('createBettingMarket', ([["en", "Away"]], [["en", "Away"]], '0.0.1'))
+		])
+		operations += 4
+	approveAll()
+
+	groups = [object_id for object_id in chain.objects if object_id.startswith('1.20.')]
+	mint.batch([('updateBettingMarketGroup', (group, None, None, None, 'closed')) for group in groups], batch_max_ops)
+	operations += len(groups)
+	approveAll()
+
+	markets = {}
+	for object_id, item in chain.objects.items():
+		if object_id.startswith('1.21.'):
+			markets.setdefault(item['group_id'], []).append(object_id)
+	mint.batch([('resolveBettingMarketGroup', (group, [[markets[group][0], 'win'], [markets[group][1], 'not_win']])) for group in groups], batch_max_ops)
+	operations += len(groups)
+	approveAll()
+	return operations
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark MINT operations against the in-memory chain simulator')
+	parser.add_argument('--events', type=int, default=1000)
+	parser.add_argument('--batch-max-ops', type=int, default=50)
+	parser.add_argument('--broadcast-latency', type=float, default=0.0, help='simulated seconds per broadcast')
+	args = parser.parse_args()
+	with open(os.path.join(ROOT, 'config-bos-mint.yaml'), 'r') as stream:
+		chain = chainsim.ChainSimulator(yaml.safe_load(stream), {"broadcast_latency": args.broadcast_latency})
+	mint.useNode(chainsim.SimulatedNode(chain))
+	started = time.perf_counter()
+	operations = lifecycle(chain, args.events, args.batch_max_ops)
+	elapsed = time.perf_counter() - started
+	statuses = {}
+	for object_id, item in chain.objects.items():
+		if object_id.startswith('1.20.'):
+			statuses[item['status']] = statuses.get(item['status'], 0) + 1
+	print('%d operations in %.2f s, %.0f ops/s, betting market groups %s' % (operations, elapsed, operations / elapsed, statuses))
+	print('%-28s %8s %8s %10s %10s' % ('call', 'calls', 'errors', 'avg ms', 'max ms'))
+	for name, entry in sorted(mint.stats()['calls'].items()):
+		print('%-28s %8d %8d %10.3f %10.3f' % (name, entry['calls'], entry['errors'], entry['avg_ms'], entry['max_ms']))
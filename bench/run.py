@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+import load
+import stubmm
+
+# Benchmark run
+# Starts the stub Market Maker, starts qaapi.py against it from a temporary
+# directory holding a generated config.yaml, drives it with the load driver
+# and reports. Runs offline; qaapi's own dependencies must be installed.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def freePort():
+	with socket.socket() as probe:
+		probe.bind(('127.0.0.1', 0))
+		return probe.getsockname()[1]
+
+def waitForPort(port, process, timeout=30.0):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError('qaapi exited with status %d' % process.returncode)
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout=1).close()
+			return
+		except OSError:
+			time.sleep(0.1)
+	raise RuntimeError('qaapi did not start listening on port %d' % port)
+
+def qaapiConfig(market_maker_url, port, engine, cache):
+	"""
+	The repository's config.yaml pointed at the stub and at ``port``, with
+	everything that needs a witness node turned off.
+	"""
+	with open(os.path.join(ROOT, 'config.yaml'), 'r') as stream:
+		config = yaml.safe_load(stream)
+	config['market-maker']['url'] = market_maker_url
+	config['history'] = dict(config.get('history') or {}, enabled=False)
+	mint = config.setdefault('mint', {})
+	mint['witness_nodes'] = dict(mint.get('witness_nodes') or {}, enabled=False)
+	if not cache:
+		config['cache'] = dict(config.get('cache') or {}, ttl={})
+	server = config.setdefault('server', {})
+	server['engine'] = engine
+	server['host'] = '127.0.0.1'
+	server['port'] = port
+	return config
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark qaapi against a local stub Market Maker')
+	parser.add_argument('--engine', choices=['flask', 'asyncio'], default='flask')
+	parser.add_argument('--latency', type=float, default=0.02, help='stub Market Maker delay in seconds')
+	parser.add_argument('--jitter', type=float, default=0.0, help='extra random stub delay, up to this many seconds')
+	parser.add_argument('--size', type=int, default=2048, help='stub response body size in bytes')
+	parser.add_argument('--no-cache', dest='cache', action='store_false', help='send every read to the stub')
+	parser.add_argument('--concurrency', type=int, default=16)
+	parser.add_argument('--duration', type=float, default=10.0)
+	parser.add_argument('--warmup', type=float, default=2.0)
+	parser.add_argument('--route', action='append', dest='routes')
+	parser.add_argument('--gzip', action='store_true', help='send Accept-Encoding: gzip')
+	parser.add_argument('--json', help='write the results to this file, e.g. to serve as a baseline')
+	parser.add_argument('--baseline', help='results of an earlier run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 and rps regression against the baseline')
+	args = parser.parse_args()
+
+	stub = stubmm.StubMarketMaker(latency=args.latency, jitter=args.jitter, size=args.size).start()
+	port = freePort()
+	workdir = tempfile.mkdtemp(prefix='qaapi-bench-')
+	with open(os.path.join(workdir, 'config.yaml'), 'w') as output:
+		yaml.safe_dump(qaapiConfig(stub.url, port, args.engine, args.cache), output, default_flow_style=False)
+	# the development server logs every request, so its output goes to a file
+	log_path = os.path.join(workdir, 'qaapi.log')
+	with open(log_path, 'w') as log:
+		process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'qaapi.py')], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+	try:
+		waitForPort(port, process)
+		result = load.run('http://127.0.0.1:%d' % port, args.routes, args.concurrency, args.duration, args.warmup, {'Accept-Encoding': 'gzip'} if args.gzip else None)
+	except RuntimeError as e:
+		with open(log_path, 'r') as log:
+			sys.stderr.write(log.read()[-4000:])
+		sys.exit(str(e))
+	finally:
+		if process.poll() is None:
+			process.terminate()
+			process.wait()
+		stub.stop()
+	result["settings"] = {
+		"engine": args.engine,
+		"latency": args.latency,
+		"jitter": args.jitter,
+		"size": args.size,
+		"cache": args.cache,
+		"gzip": args.gzip
+	}
+	print('engine=%s latency=%gs size=%dB cache=%s concurrency=%d stub requests=%d' % (
+		args.engine, args.latency, args.size, args.cache, args.concurrency, stub.requests))
+	print(load.report(result))
+	if args.json:
+		with open(args.json, 'w') as output:
+			json.dump(result, output, indent=2)
+	if args.baseline:
+		with open(args.baseline, 'r') as stream:
+			found = load.regressions(result, json.load(stream), args.tolerance)
+		for line in found:
+			print('REGRESSION ' + line)
+		if found:
+			sys.exit(1)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+# Stub Market Maker
+# Answers every bookieapi route with a JSON body of a chosen size after a
+# chosen delay, so qaapi can be benchmarked offline. Bodies are generated from
+# a fixed seed and are the same for every request to the same path.
+
+def payload(path, size):
+	"""
+	A JSON list of event-like objects of about ``size`` bytes.
+	"""
+	rng = random.Random(path)
+	items = []
+	length = 2
+	index = 0
+	while length < size:
+		item = {
+			"id": "1.18.%d" % index,
+			"event_group_id": "1.17.%d" % rng.randint(0, 50),
+			"name": [["en", "Team %d v Team %d" % (rng.randint(0, 999), rng.randint(0, 999))]],
+			"season": [["en", "2018"]],
+			"start_time": "2018-07-%02dT%02d:00:00" % (rng.randint(1, 28), rng.randint(0, 23)),
+			"status": rng.choice(["upcoming", "in_progress", "finished"]),
+			"scores": []
+		}
+		items.append(item)
+		length += len(json.dumps(item)) + 2
+		index += 1
+	return json.dumps(items).encode('utf-8')
+
+class StubMarketMaker(object):
+
+	def __init__(self, host='127.0.0.1', port=0, latency=0.02, jitter=0.0, size=2048):
+		self.latency = latency
+		self.jitter = jitter
+		self.size = size
+		self.bodies = {}
+		self.lock = threading.Lock()
+		self.requests = 0
+		stub = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			# headers and body go out in separate writes; without TCP_NODELAY the
+			# body waits on the client's delayed ACK, about 40 ms per request
+			disable_nagle_algorithm = True
+
+			def respond(self):
+				length = int(self.headers.get('Content-Length') or 0)
+				if length:
+					self.rfile.read(length)
+				body = stub.body(self.path)
+				delay = stub.latency + random.uniform(0, stub.jitter)
+				if delay > 0:
+					time.sleep(delay)
+				self.send_response(200)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			do_GET = respond
+			do_POST = respond
+			do_PUT = respond
+			do_DELETE = respond
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = ThreadingHTTPServer((host, port), Handler)
+		self.server.daemon_threads = True
+
+	@property
+	def url(self):
+		host, port = self.server.server_address[:2]
+		return 'http://%s:%d' % (host, port)
+
+	def body(self, path):
+		with self.lock:
+			self.requests += 1
+			body = self.bodies.get(path)
+			if body is None:
+				body = self.bodies[path] = payload(path, self.size)
+			return body
+
+	def start(self):
+		thread = threading.Thread(target=self.server.serve_forever, name='stub-market-maker')
+		thread.daemon = True
+		thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Stub bookieapi Market Maker for benchmarks')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8010)
+	parser.add_argument('--latency', type=float, default=0.02, help='seconds before each response')
+	parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay, up to this many seconds')
+	parser.add_argument('--size', type=int, default=2048, help='approximate response body size in bytes')
+	args = parser.parse_args()
+	stub = StubMarketMaker(args.host, args.port, args.latency, args.jitter, args.size)
+	print('stub Market Maker on %s' % stub.url)
+	try:
+		stub.server.serve_forever()
+	except KeyboardInterrupt:
+		pass
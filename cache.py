@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+# In-process response cache
+# Bounded LRU of upstream responses with a TTL per resource type. Entries are
+# tagged with their resource so MINT writes can drop everything they affect.
+# A write only reaches the Market Maker's node once it is in a block, so after
+# an invalidation nothing of that resource is cached again for ``settle``
+# seconds; reads in that window still go upstream but are not kept.
+
+class TTLCache(object):
+
+	def __init__(self, config):
+		self.max_entries = config.get('max_entries', 1024)
+		self.ttl = config.get('ttl') or {}
+		self.settle = config.get('settle', 6)
+		self.settling = {}
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def ttlFor(self, resource):
+		return self.ttl.get(resource, 0)
+
+	def get(self, key):
+		now = time.monotonic()
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			expires, resource, value = entry
+			if expires <= now:
+				del self.entries[key]
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def set(self, key, resource, value):
+		ttl = self.ttlFor(resource)
+		if ttl <= 0:
+			return
+		now = time.monotonic()
+		with self.lock:
+			if max(self.settling.get(resource, 0), self.settling.get('*', 0)) > now:
+				return
+			self.entries[key] = (now + ttl, resource, value)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	def invalidate(self, *resources):
+		"""
+		Drop every entry of the given resource types, or all entries when
+		called without arguments, and keep them uncached for ``settle``
+		seconds.
+		"""
+		until = time.monotonic() + self.settle
+		with self.lock:
+			for resource in resources or ('*',):
+				self.settling[resource] = until
+			if not resources:
+				stale = list(self.entries.keys())
+			else:
+				stale = [key for key, entry in self.entries.items() if entry[1] in resources]
+			for key in stale:
+				del self.entries[key]
+			self.invalidations += len(stale)
+
+	def stats(self):
+		with self.lock:
+			return {
+				"entries": len(self.entries),
+				"max_entries": self.max_entries,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"invalidations": self.invalidations
+			}
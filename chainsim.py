@@ -0,0 +1,570 @@
+import copy
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+
+# Chain simulator
+# An in-memory stand-in for the witness node behind mint.Node, so MINT routes
+# can be exercised and benchmarked offline. Operations are queued into a
+# proposal like bos_mint does, proposals execute once approved, objects get
+# chain-style ids and status changes are checked against the
+# allowed_transitions of config-bos-mint.yaml.
+
+# peerplaysbase.operationids
+OPERATION_IDS = {
+	'proposal_create': 22,
+	'proposal_update': 23,
+	'sport_create': 52,
+	'sport_update': 53,
+	'event_group_create': 54,
+	'event_group_update': 55,
+	'event_create': 56,
+	'event_update': 57,
+	'betting_market_rules_create': 58,
+	'betting_market_rules_update': 59,
+	'betting_market_group_create': 60,
+	'betting_market_create': 61,
+	'betting_market_group_resolve': 63,
+	'betting_market_group_update': 70,
+	'betting_market_update': 71,
+	'event_update_status': 72
+}
+
+# object space of each type, and the create operation that makes one
+SPACES = {
+	'sport': ('1.16', 'sport_create'),
+	'event_group': ('1.17', 'event_group_create'),
+	'event': ('1.18', 'event_create'),
+	'rules': ('1.19', 'betting_market_rules_create'),
+	'betting_market_group': ('1.20', 'betting_market_group_create'),
+	'betting_market': ('1.21', 'betting_market_create')
+}
+
+# allowed_transitions section of each status field
+STATUS_TYPES = {
+	'event': 'EventStatus',
+	'betting_market_group': 'BettingMarketGroupStatus',
+	'betting_market': 'BettingMarketStatus'
+}
+
+FEE = {"amount": 0, "asset_id": "1.3.0"}
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+class ChainSimulatorException(Exception):
+	pass
+
+def formatTime(value):
+	if isinstance(value, datetime):
+		return value.strftime(TIME_FORMAT)
+	return value
+
+class ChainSimulator(object):
+
+	def __init__(self, bos_mint_config, config=None):
+		"""
+		``bos_mint_config`` is the parsed config-bos-mint.yaml, for its
+		allowed_transitions, allowed_assets and selected account. ``config``
+		sets ``approvals_required`` per proposal (1) and a
+		``broadcast_latency`` in seconds to stand in for block time (0).
+		"""
+		config = config or {}
+		self.transitions = bos_mint_config.get('allowed_transitions') or {}
+		connection = bos_mint_config.get('connection') or {}
+		self.account_name = (connection.get(connection.get('use')) or {}).get('account', 'init0')
+		self.approvals_required = config.get('approvals_required', 1)
+		self.broadcast_latency = config.get('broadcast_latency', 0)
+		self.lock = threading.RLock()
+		self.objects = {}
+		self.next_instance = {}
+		self.accounts = {}
+		self.proposals = {}
+		self.history = {}
+		self.block_num = 1
+		# undo entries of the proposal being executed
+		self.journal = None
+		for name in bos_mint_config.get('allowed_assets') or []:
+			self._new('1.3', {"symbol": name})
+		# 1.2.0 and 1.2.1 as on chain; proposals need the witness account's approval
+		self.account('committee-account')
+		self.account('witness-account')
+		self.account(self.account_name)
+		# the rules betting market groups are created against
+		self._new('1.19', {"name": [["en", "Default rules"]], "description": [["en", "Simulated"]]})
+
+	def _allocate(self, space):
+		instance = self.next_instance.get(space, 0)
+		self.next_instance[space] = instance + 1
+		return '%s.%d' % (space, instance)
+
+	def _new(self, space, fields):
+		object_id = self._allocate(space)
+		self.objects[object_id] = dict(fields, id=object_id)
+		if self.journal is not None:
+			self.journal.append((object_id, None))
+		return object_id
+
+	def account(self, name_or_id):
+		with self.lock:
+			if name_or_id in self.objects:
+				return self.objects[name_or_id]
+			account_id = self.accounts.get(name_or_id)
+			if account_id is None:
+				account_id = self.accounts[name_or_id] = self._new('1.2', {"name": name_or_id})
+			return self.objects[account_id]
+
+	def asset(self, symbol):
+		for object_id, item in self.objects.items():
+			if object_id.startswith('1.3.') and item['symbol'] == symbol:
+				return object_id
+		raise ChainSimulatorException("unknown asset " + str(symbol))
+
+	def get(self, object_id, kind):
+		space = SPACES[kind][0]
+		if not object_id or not object_id.startswith(space + '.') or object_id not in self.objects:
+			raise ChainSimulatorException("%s %s does not exist" % (kind, object_id))
+		return self.objects[object_id]
+
+	def _mutable(self, object_id, kind):
+		"""
+		``get`` an object about to be changed, keeping its old state in case
+		the proposal changing it fails.
+		"""
+		item = self.get(object_id, kind)
+		if self.journal is not None:
+			self.journal.append((object_id, copy.deepcopy(item)))
+		return item
+
+	def checkTransition(self, kind, current, status):
+		if status is None or status == current:
+			return
+		allowed = self.transitions.get(STATUS_TYPES[kind], {}).get(current) or []
+		if status not in allowed:
+			raise ChainSimulatorException("%s status %s cannot change to %s" % (kind, current, status))
+
+	def _record(self, account_id, op, result):
+		"""
+		Append an operation to an account's history, as the history plugin does.
+		"""
+		operation_id = self._allocate('1.11')
+		instance = int(operation_id.rsplit('.', 1)[1])
+		self.history.setdefault(account_id, []).append({
+			"id": operation_id,
+			"block_num": self.block_num,
+			"op": op,
+			"op_in_trx": 0,
+			"result": result,
+			"trx_in_block": 0,
+			"virtual_op": instance
+		})
+
+	def _expire(self):
+		now = datetime.utcnow().strftime(TIME_FORMAT)
+		for proposal_id in [proposal_id for proposal_id, proposal in self.proposals.items() if proposal['expiration_time'] <= now]:
+			del self.proposals[proposal_id]
+
+	def _transaction(self, operations, results):
+		self.block_num += 1
+		return {
+			"expiration": (datetime.utcnow() + timedelta(seconds=30)).strftime(TIME_FORMAT),
+			"ref_block_num": self.block_num & 0xffff,
+			"ref_block_prefix": 0,
+			"operations": operations,
+			"operation_results": results,
+			"extensions": [],
+			"signatures": []
+		}
+
+	def propose(self, account_name, operations, expiration=60 * 60 * 48):
+		"""
+		Broadcast a proposal of ``operations``, ``[op_id, data]`` pairs, and
+		return its transaction.
+		"""
+		if self.broadcast_latency:
+			time.sleep(self.broadcast_latency)
+		with self.lock:
+			proposer = self.account(account_name)['id']
+			expiration_time = (datetime.utcnow() + timedelta(seconds=expiration)).strftime(TIME_FORMAT)
+			proposal_id = self._allocate('1.10')
+			proposal = self.proposals[proposal_id] = {
+				"id": proposal_id,
+				"proposer": proposer,
+				"expiration_time": expiration_time,
+				"proposed_transaction": {
+					"expiration": expiration_time,
+					"ref_block_num": 0,
+					"ref_block_prefix": 0,
+					"operations": copy.deepcopy(operations),
+					"extensions": []
+				},
+				"required_active_approvals": ["1.2.1"],
+				"available_active_approvals": [],
+				"required_owner_approvals": [],
+				"available_owner_approvals": [],
+				"available_key_approvals": []
+			}
+			op = [OPERATION_IDS['proposal_create'], {
+				"fee": FEE,
+				"fee_paying_account": proposer,
+				"expiration_time": expiration_time,
+				"proposed_ops": [{"op": operation} for operation in proposal['proposed_transaction']['operations']],
+				"extensions": []
+			}]
+			self._record(proposer, op, [1, proposal_id])
+			return self._transaction([op], [[1, proposal_id]])
+
+	def vote(self, proposal_ids, account_name, approve):
+		"""
+		Add or remove ``account_name``'s approval of each proposal, executing
+		those that reach ``approvals_required``. A proposal whose execution
+		fails stays open with a ``fail_reason``, as on chain.
+		"""
+		if self.broadcast_latency:
+			time.sleep(self.broadcast_latency)
+		with self.lock:
+			self._expire()
+			approver = self.account(account_name)['id']
+			operations = []
+			for proposal_id in proposal_ids:
+				proposal = self.proposals.get(proposal_id)
+				if proposal is None:
+					raise ChainSimulatorException("proposal %s does not exist" % proposal_id)
+				change = "active_approvals_to_add" if approve else "active_approvals_to_remove"
+				operations.append([OPERATION_IDS['proposal_update'], {
+					"fee": FEE,
+					"fee_paying_account": approver,
+					"proposal": proposal_id,
+					change: [approver],
+					"extensions": []
+				}])
+			for proposal_id in proposal_ids:
+				proposal = self.proposals[proposal_id]
+				approvals = proposal['available_active_approvals']
+				if approve and approver not in approvals:
+					approvals.append(approver)
+				elif not approve and approver in approvals:
+					approvals.remove(approver)
+				if len(approvals) >= self.approvals_required:
+					self._execute(proposal)
+			for operation in operations:
+				self._record(approver, operation, [0, {}])
+			return self._transaction(operations, [[0, {}] for operation in operations])
+
+	def _execute(self, proposal):
+		"""
+		Apply a proposal's operations all or nothing, resolving relative ids
+		``0.0.n`` to the objects created by its ``n``th operation.
+		"""
+		self.journal = []
+		created = {}
+		try:
+			for index, (op_id, data) in enumerate(proposal['proposed_transaction']['operations']):
+				created[index] = self._apply(op_id, data, created)
+		except ChainSimulatorException as e:
+			for object_id, before in reversed(self.journal):
+				if before is None:
+					del self.objects[object_id]
+				else:
+					self.objects[object_id] = before
+			proposal['fail_reason'] = str(e)
+			return
+		finally:
+			self.journal = None
+		del self.proposals[proposal['id']]
+
+	def _resolve(self, object_id, created, kind):
+		if isinstance(object_id, str) and object_id.startswith('0.0.'):
+			object_id = created.get(int(object_id.rsplit('.', 1)[1]))
+		return self.get(object_id, kind)['id']
+
+	def _apply(self, op_id, data, created):
+		if op_id == OPERATION_IDS['sport_create']:
+			return self._new('1.16', {"name": data['name']})
+		if op_id == OPERATION_IDS['sport_update']:
+			sport = self._mutable(self._resolve(data['sport_id'], created, 'sport'), 'sport')
+			sport['name'] = data['new_name'] or sport['name']
+			return sport['id']
+		if op_id == OPERATION_IDS['event_group_create']:
+			return self._new('1.17', {"name": data['name'], "sport_id": self._resolve(data['sport_id'], created, 'sport')})
+		if op_id == OPERATION_IDS['event_group_update']:
+			group = self._mutable(self._resolve(data['event_group_id'], created, 'event_group'), 'event_group')
+			if data.get('new_sport_id'):
+				group['sport_id'] = self._resolve(data['new_sport_id'], created, 'sport')
+			group['name'] = data.get('new_name') or group['name']
+			return group['id']
+		if op_id == OPERATION_IDS['event_create']:
+			status = self._created('event')
+			return self._new('1.18', {
+				"name": data['name'],
+				"season": data['season'],
+				"start_time": data['start_time'],
+				"event_group_id": self._resolve(data['event_group_id'], created, 'event_group'),
+				"status": status,
+				"scores": []
+			})
+		if op_id in (OPERATION_IDS['event_update'], OPERATION_IDS['event_update_status']):
+			event = self._mutable(self._resolve(data['event_id'], created, 'event'), 'event')
+			status = data.get('new_status', data.get('status'))
+			self.checkTransition('event', event['status'], status)
+			if data.get('new_event_group_id'):
+				event['event_group_id'] = self._resolve(data['new_event_group_id'], created, 'event_group')
+			for field in ('name', 'season', 'start_time'):
+				if data.get('new_' + field):
+					event[field] = data['new_' + field]
+			if status is not None:
+				event['status'] = status
+			if 'scores' in data:
+				event['scores'] = data['scores']
+			return event['id']
+		if op_id == OPERATION_IDS['betting_market_rules_create']:
+			return self._new('1.19', {"name": data['name'], "description": data['description']})
+		if op_id == OPERATION_IDS['betting_market_rules_update']:
+			rules = self._mutable(self._resolve(data['betting_market_rules_id'], created, 'rules'), 'rules')
+			rules['name'] = data.get('new_name') or rules['name']
+			rules['description'] = data.get('new_description') or rules['description']
+			return rules['id']
+		if op_id == OPERATION_IDS['betting_market_group_create']:
+			return self._new('1.20', {
+				"description": data['description'],
+				"event_id": self._resolve(data['event_id'], created, 'event'),
+				"rules_id": self._resolve(data['rules_id'], created, 'rules'),
+				"asset_id": data['asset_id'],
+				"never_in_play": data.get('never_in_play', False),
+				"delay_before_settling": data.get('delay_before_settling', 0),
+				"status": self._created('betting_market_group')
+			})
+		if op_id == OPERATION_IDS['betting_market_group_update']:
+			group = self._mutable(self._resolve(data['betting_market_group_id'], created, 'betting_market_group'), 'betting_market_group')
+			self.checkTransition('betting_market_group', group['status'], data.get('status'))
+			if data.get('new_event_id'):
+				group['event_id'] = self._resolve(data['new_event_id'], created, 'event')
+			if data.get('new_rules_id'):
+				group['rules_id'] = self._resolve(data['new_rules_id'], created, 'rules')
+			group['description'] = data.get('new_description') or group['description']
+			group['status'] = data.get('status') or group['status']
+			return group['id']
+		if op_id == OPERATION_IDS['betting_market_create']:
+			return self._new('1.21', {
+				"group_id": self._resolve(data['group_id'], created, 'betting_market_group'),
+				"description": data['description'],
+				"payout_condition": data['payout_condition'],
+				"status": self._created('betting_market')
+			})
+		if op_id == OPERATION_IDS['betting_market_update']:
+			market = self._mutable(self._resolve(data['betting_market_id'], created, 'betting_market'), 'betting_market')
+			if data.get('new_group_id'):
+				market['group_id'] = self._resolve(data['new_group_id'], created, 'betting_market_group')
+			market['description'] = data.get('new_description') or market['description']
+			market['payout_condition'] = data.get('new_payout_condition') or market['payout_condition']
+			return market['id']
+		if op_id == OPERATION_IDS['betting_market_group_resolve']:
+			group = self._mutable(self._resolve(data['betting_market_group_id'], created, 'betting_market_group'), 'betting_market_group')
+			self.checkTransition('betting_market_group', group['status'], 'graded')
+			for market_id, resolution in data['resolutions']:
+				market = self._mutable(self._resolve(market_id, created, 'betting_market'), 'betting_market')
+				if market['group_id'] != group['id']:
+					raise ChainSimulatorException("betting market %s is not in group %s" % (market['id'], group['id']))
+				status = 'canceled' if resolution == 'cancel' else resolution
+				self.checkTransition('betting_market', market['status'], status)
+				market['status'] = status
+			group['status'] = 'graded'
+			return group['id']
+		raise ChainSimulatorException("operation %d is not simulated" % op_id)
+
+	def _created(self, kind):
+		"""
+		The status a new object starts in, the first ``create`` transition.
+		"""
+		allowed = self.transitions.get(STATUS_TYPES[kind], {}).get('create') or []
+		if not allowed:
+			raise ChainSimulatorException("no create transition for " + STATUS_TYPES[kind])
+		return allowed[0]
+
+	def openProposals(self):
+		with self.lock:
+			self._expire()
+			return [copy.deepcopy(proposal) for proposal in sorted(self.proposals.values(), key=lambda proposal: int(proposal['id'].rsplit('.', 1)[1]))]
+
+	def accountHistory(self, account_id, stop, limit, start):
+		"""
+		history_api.get_account_history: newest first, ids in (stop, start],
+		start ``1.11.0`` meaning the newest.
+		"""
+		stop = int(stop.rsplit('.', 1)[1])
+		start = int(start.rsplit('.', 1)[1]) or None
+		with self.lock:
+			found = []
+			for entry in reversed(self.history.get(account_id, [])):
+				instance = int(entry['id'].rsplit('.', 1)[1])
+				if start is not None and instance > start:
+					continue
+				if instance <= stop or len(found) >= limit:
+					break
+				found.append(copy.deepcopy(entry))
+			return found
+
+class _Connection(object):
+
+	def disconnect(self):
+		pass
+
+class _Rpc(object):
+	"""
+	The few witness node API calls mint.py makes directly.
+	"""
+
+	def __init__(self, chain):
+		self.chain = chain
+		self.connection = _Connection()
+
+	def get_account_by_name(self, name, api=None):
+		return self.chain.account(name)
+
+	def get_account_history(self, account_id, stop, limit, start, api=None):
+		return self.chain.accountHistory(account_id, stop, limit, start)
+
+	def get_binned_order_book(self, betting_market_id, precision, api=None):
+		# nobody bets on a simulated chain
+		return {"aggregated_back_bets": [], "aggregated_lay_bets": []}
+
+class _PeerPlays(object):
+	"""
+	The PeerPlays instance ``Node.get_node()`` returns.
+	"""
+
+	def __init__(self, chain):
+		self.chain = chain
+		self.rpc = _Rpc(chain)
+
+	def connect(self):
+		pass
+
+	def approveproposal(self, proposal_ids, account, approver=None):
+		return self.chain.vote(proposal_ids, approver or account, True)
+
+	def disapproveproposal(self, proposal_ids, account, approver=None):
+		return self.chain.vote(proposal_ids, approver or account, False)
+
+class SimulatedNode(object):
+	"""
+	bos_mint.node.Node as mint.py uses it, backed by a ChainSimulator.
+	"""
+
+	def __init__(self, chain):
+		self.chain = chain
+		self.instance = _PeerPlays(chain)
+		self.pending = []
+
+	def get_node(self):
+		return self.instance
+
+	def getSelectedAccountName(self):
+		return self.chain.account_name
+
+	def _queue(self, operation, data):
+		"""
+		Check an operation against the chain as it stands, and the operations
+		queued before it, and append it to the pending proposal.
+		"""
+		with self.chain.lock:
+			data = dict(data, fee=FEE)
+			for field, kind in (
+					('sport_id', 'sport'), ('new_sport_id', 'sport'),
+					('event_group_id', 'event_group'), ('new_event_group_id', 'event_group'),
+					('event_id', 'event'), ('new_event_id', 'event'),
+					('rules_id', 'rules'), ('new_rules_id', 'rules'), ('betting_market_rules_id', 'rules'),
+					('group_id', 'betting_market_group'), ('new_group_id', 'betting_market_group'),
+					('betting_market_group_id', 'betting_market_group'),
+					('betting_market_id', 'betting_market')):
+				if data.get(field):
+					self._check(data[field], kind)
+			self.pending.append([OPERATION_IDS[operation], data])
+			return self.pending[-1]
+
+	def _check(self, object_id, kind):
+		if object_id.startswith('0.0.'):
+			index = int(object_id.rsplit('.', 1)[1])
+			if index >= len(self.pending) or self.pending[index][0] != OPERATION_IDS[SPACES[kind][1]]:
+				raise ChainSimulatorException("%s does not refer to a queued %s" % (object_id, kind))
+			return None
+		return self.chain.get(object_id, kind)
+
+	def _status(self, object_id, kind, status):
+		current = self._check(object_id, kind)
+		if current is not None:
+			self.chain.checkTransition(kind, current['status'], status)
+			if current['status'] == status:
+				return None
+		return status
+
+	def createSport(self, istrings):
+		return self._queue('sport_create', {"name": istrings})
+
+	def updateSport(self, sportId, istrings):
+		return self._queue('sport_update', {"sport_id": sportId, "new_name": istrings})
+
+	def createEventGroup(self, istrings, sportId):
+		return self._queue('event_group_create', {"name": istrings, "sport_id": sportId})
+
+	def updateEventGroup(self, eventGroupId, istrings, sportId):
+		return self._queue('event_group_update', {"event_group_id": eventGroupId, "new_name": istrings, "new_sport_id": sportId})
+
+	def createEvent(self, name, season, startTime, eventGroupId):
+		return self._queue('event_create', {"name": name, "season": season, "start_time": formatTime(startTime), "event_group_id": eventGroupId})
+
+	def updateEvent(self, eventId, name, season, startTime, eventGroupId, status):
+		data = {"event_id": eventId, "new_name": name, "new_season": season, "new_start_time": formatTime(startTime), "new_event_group_id": eventGroupId}
+		status = self._status(eventId, 'event', status)
+		if status is not None:
+			data['new_status'] = status
+		return self._queue('event_update', data)
+
+	def updateEventStatus(self, eventId, status, scores=[]):
+		self._status(eventId, 'event', status)
+		return self._queue('event_update_status', {"event_id": eventId, "status": status, "scores": scores})
+
+	def createBettingMarketGroupRule(self, name, description):
+		return self._queue('betting_market_rules_create', {"name": name, "description": description})
+
+	def updateBettingMarketGroupRule(self, bmgrId, name, description):
+		return self._queue('betting_market_rules_update', {"betting_market_rules_id": bmgrId, "new_name": name, "new_description": description})
+
+	def createBettingMarketGroup(self, description, eventId, bettingMarketRuleId, asset):
+		return self._queue('betting_market_group_create', {"description": description, "event_id": eventId, "rules_id": bettingMarketRuleId, "asset_id": self.chain.asset(asset), "never_in_play": False, "delay_before_settling": 0})
+
+	def updateBettingMarketGroup(self, bmgId, description, eventId, rulesId, status):
+		data = {"betting_market_group_id": bmgId, "new_description": description, "new_event_id": eventId, "new_rules_id": rulesId}
+		status = self._status(bmgId, 'betting_market_group', status)
+		if status is not None:
+			data['status'] = status
+		return self._queue('betting_market_group_update', data)
+
+	def createBettingMarket(self, payoutCondition, description, bettingMarketGroupId):
+		return self._queue('betting_market_create', {"payout_condition": payoutCondition, "description": description, "group_id": bettingMarketGroupId})
+
+	def updateBettingMarket(self, bmId, payout_condition, descriptions, bmgId):
+		return self._queue('betting_market_update', {"betting_market_id": bmId, "new_payout_condition": payout_condition, "new_description": descriptions, "new_group_id": bmgId})
+
+	def resolveBettingMarketGroup(self, bettingMarketGroupId, resultList):
+		self._status(bettingMarketGroupId, 'betting_market_group', 'graded')
+		return self._queue('betting_market_group_resolve', {"betting_market_group_id": bettingMarketGroupId, "resolutions": resultList})
+
+	def broadcastPendingTransaction(self):
+		if not self.pending:
+			return None
+		operations = self.pending
+		self.pending = []
+		return self.chain.propose(self.getSelectedAccountName(), operations)
+
+	def discardPendingTransaction(self):
+		self.pending = []
+
+	def getAllProposals(self, accountName=None):
+		return self.chain.openProposals()
+
+	def acceptProposal(self, proposalId):
+		return self.instance.approveproposal([proposalId], self.getSelectedAccountName(), self.getSelectedAccountName())
+
+	def rejectProposal(self, proposalId):
+		return self.instance.disapproveproposal([proposalId], self.getSelectedAccountName(), self.getSelectedAccountName())
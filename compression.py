@@ -0,0 +1,106 @@
+import gzip
+import threading
+import time
+import zlib
+from werkzeug.http import parse_accept_header
+import metrics
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# Response compression
+# Negotiates a Content-Encoding from the client's Accept-Encoding for JSON and
+# text bodies over a size threshold. brotli and zstd are offered only when
+# their packages are installed.
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+DEFAULT_LEVELS = {
+	'gzip': 6,
+	'deflate': 6,
+	'br': 4,
+	'zstd': 3
+}
+
+def _gzip(body, level):
+	return gzip.compress(body, compresslevel=level, mtime=0)
+
+def _deflate(body, level):
+	# HTTP deflate is the zlib format, not raw deflate
+	return zlib.compress(body, level)
+
+def _brotli(body, level):
+	return brotli.compress(body, quality=level)
+
+def _zstd(body, level):
+	return zstandard.ZstdCompressor(level=level).compress(body)
+
+ENCODERS = {
+	'gzip': _gzip,
+	'deflate': _deflate
+}
+if brotli is not None:
+	ENCODERS['br'] = _brotli
+if zstandard is not None:
+	ENCODERS['zstd'] = _zstd
+
+class Compressor(object):
+
+	def __init__(self, config):
+		self.enabled = config.get('enabled', True)
+		self.min_size = config.get('min_size', 1024)
+		self.levels = dict(DEFAULT_LEVELS, **(config.get('level') or {}))
+		# server preference among encodings the client rates equally
+		self.encodings = [name for name in config.get('encodings', ['br', 'zstd', 'gzip', 'deflate']) if name in ENCODERS]
+		self.lock = threading.Lock()
+		self.responses = {}
+		self.bytes_in = 0
+		self.bytes_out = 0
+
+	def compressible(self, content_type, size):
+		if not self.enabled or size < self.min_size or not content_type:
+			return False
+		return content_type.startswith(COMPRESSIBLE_TYPES)
+
+	def negotiate(self, accept_encoding):
+		"""
+		The encoding to use for a client sending ``accept_encoding``, or None
+		to send the body as is.
+		"""
+		if not accept_encoding:
+			return None
+		accept = parse_accept_header(accept_encoding)
+		best = None
+		best_quality = 0
+		for name in self.encodings:
+			quality = accept.quality(name)
+			if quality > best_quality:
+				best = name
+				best_quality = quality
+		return best
+
+	def compress(self, body, encoding):
+		started = time.perf_counter()
+		compressed = ENCODERS[encoding](body, self.levels[encoding])
+		metrics.addTiming('serialize', time.perf_counter() - started)
+		with self.lock:
+			self.responses[encoding] = self.responses.get(encoding, 0) + 1
+			self.bytes_in += len(body)
+			self.bytes_out += len(compressed)
+		return compressed
+
+	def stats(self):
+		with self.lock:
+			return {
+				"responses": dict(self.responses),
+				"bytes_in": self.bytes_in,
+				"bytes_out": self.bytes_out,
+				"encodings": list(self.encodings)
+			}
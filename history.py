@@ -0,0 +1,120 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+# Bettor history
+# Append-only local copy of each bettor's operation history. Operations never
+# change once on chain, so a poll only asks the chain for operations newer than
+# the last one held.
+
+def instance(operation_id):
+	return int(operation_id.rsplit('.', 1)[1])
+
+class _Account(object):
+
+	def __init__(self, account_id):
+		self.account_id = account_id
+		self.ops = []
+		self.instances = []
+		self.blocks = []
+		self.synced = 0.0
+		self.lock = threading.Lock()
+
+	def append(self, ops):
+		for op in ops:
+			op_instance = instance(op['id'])
+			if self.instances and op_instance <= self.instances[-1]:
+				continue
+			self.ops.append(op)
+			self.instances.append(op_instance)
+			self.blocks.append(op['block_num'])
+
+class BettorHistory(object):
+
+	def __init__(self, fetch, resolve, config):
+		"""
+		``fetch(account_id, stop, limit, start)`` pages the chain's account
+		history newest first, like history_api.get_account_history, and
+		``resolve(account)`` turns an account name into its id.
+		"""
+		self.fetch = fetch
+		self.resolve = resolve
+		self.page_size = config.get('page_size', 100)
+		self.min_interval = config.get('min_interval', 1.0)
+		self.max_accounts = config.get('max_accounts', 1000)
+		self.accounts = OrderedDict()
+		self.lock = threading.Lock()
+		self.fetched = 0
+		self.polls = 0
+
+	def _account(self, account):
+		with self.lock:
+			entry = self.accounts.get(account)
+			if entry is not None:
+				self.accounts.move_to_end(account)
+				return entry
+		account_id = account if account.startswith('1.2.') else self.resolve(account)
+		with self.lock:
+			entry = self.accounts.get(account)
+			if entry is None:
+				entry = self.accounts[account] = _Account(account_id)
+				while len(self.accounts) > self.max_accounts:
+					self.accounts.popitem(last=False)
+			return entry
+
+	def _sync(self, entry):
+		"""
+		Append the operations newer than the newest one held.
+		"""
+		stop = '1.11.%d' % entry.instances[-1] if entry.instances else '1.11.0'
+		start = '1.11.0'
+		new = []
+		while True:
+			page = self.fetch(entry.account_id, stop, self.page_size, start)
+			new.extend(page)
+			if len(page) < self.page_size:
+				break
+			oldest = instance(page[-1]['id'])
+			if oldest - 1 <= instance(stop):
+				break
+			start = '1.11.%d' % (oldest - 1)
+		new.sort(key=lambda op: instance(op['id']))
+		entry.append(new)
+		entry.synced = time.monotonic()
+		with self.lock:
+			self.fetched += len(new)
+
+	def query(self, account, since=None, since_block=None, limit=None):
+		"""
+		Operations of ``account`` after operation id ``since`` and after block
+		``since_block``, oldest first, at most ``limit`` of them, and the
+		cursor of the next page or None. Without any of these the whole
+		history is returned newest first, as the chain lists it.
+		"""
+		entry = self._account(account)
+		with entry.lock:
+			if time.monotonic() - entry.synced >= self.min_interval:
+				self._sync(entry)
+			with self.lock:
+				self.polls += 1
+			if since is None and since_block is None and limit is None:
+				return list(reversed(entry.ops)), None
+			position = 0
+			if since is not None:
+				position = bisect.bisect_right(entry.instances, instance(since))
+			if since_block is not None:
+				position = max(position, bisect.bisect_right(entry.blocks, since_block))
+			end = len(entry.ops) if limit is None else position + limit
+			page = entry.ops[position:end]
+			next_cursor = page[-1]['id'] if page and end < len(entry.ops) else None
+			return page, next_cursor
+
+	def stats(self):
+		with self.lock:
+			return {
+				"accounts": len(self.accounts),
+				"operations": sum(len(entry.ops) for entry in self.accounts.values()),
+				"fetched": self.fetched,
+				"polls": self.polls
+			}
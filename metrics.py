@@ -0,0 +1,153 @@
+import bisect
+import contextvars
+import threading
+
+# Metrics
+# Counters and histograms kept in process and rendered in the Prometheus text
+# exposition format at /metrics. An observation is a bisect and a few integer
+# updates under a per-series lock, cheap enough for every request.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from a cache hit to a slow broadcast
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+	pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+	if extra is not None:
+		pairs.append('%s="%s"' % extra)
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+
+	def __init__(self, name, documentation, labels=()):
+		self.name = name
+		self.documentation = documentation
+		self.label_names = tuple(labels)
+		self.values = {}
+		self.lock = threading.Lock()
+
+	def inc(self, *label_values, amount=1):
+		with self.lock:
+			self.values[label_values] = self.values.get(label_values, 0) + amount
+
+	def render(self):
+		lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+		with self.lock:
+			for label_values, value in sorted(self.values.items()):
+				lines.append('%s%s %s' % (self.name, _labels(self.label_names, label_values), _number(value)))
+		return lines
+
+class Histogram(object):
+
+	def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.label_names = tuple(labels)
+		self.buckets = tuple(buckets)
+		# per label set: a count per bucket plus one for +Inf, then sum
+		self.series = {}
+		self.lock = threading.Lock()
+
+	def observe(self, value, *label_values):
+		index = bisect.bisect_left(self.buckets, value)
+		with self.lock:
+			series = self.series.get(label_values)
+			if series is None:
+				series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+			series[0][index] += 1
+			series[1] += value
+
+	def render(self):
+		lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+		with self.lock:
+			for label_values, (counts, total) in sorted(self.series.items()):
+				cumulative = 0
+				for bound, count in zip(self.buckets + (float('inf'),), counts):
+					cumulative += count
+					lines.append('%s_bucket%s %d' % (self.name, _labels(self.label_names, label_values, ('le', _number(bound))), cumulative))
+				labels = _labels(self.label_names, label_values)
+				lines.append('%s_sum%s %s' % (self.name, labels, repr(total)))
+				lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+		return lines
+
+class Registry(object):
+
+	def __init__(self):
+		self.metrics = []
+
+	def register(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def render(self):
+		lines = []
+		for metric in self.metrics:
+			lines.extend(metric.render())
+		return '\n'.join(lines) + '\n'
+
+# Server-Timing
+# Time a request spends in each phase, summed in a dict the request's own
+# context holds, so Market Maker and Node calls can add to it without being
+# passed the request. Calls made on other threads, like the cancel fan-out,
+# are not attributed.
+
+TIMING_PHASES = ('queue', 'parse', 'upstream', 'serialize')
+
+_timings = contextvars.ContextVar('timings', default=None)
+
+def startTimings():
+	timings = {}
+	_timings.set(timings)
+	return timings
+
+def addTiming(phase, seconds):
+	timings = _timings.get()
+	if timings is not None:
+		timings[phase] = timings.get(phase, 0.0) + seconds
+
+def serverTiming(timings, total):
+	"""
+	``Server-Timing`` header value for the phase ``timings`` of a request
+	that took ``total`` seconds. ``app`` is what no phase accounts for.
+	"""
+	parts = []
+	accounted = 0.0
+	for phase in TIMING_PHASES:
+		if phase in timings:
+			accounted += timings[phase]
+			parts.append('%s;dur=%.2f' % (phase, timings[phase] * 1000))
+	parts.append('app;dur=%.2f' % (max(total - accounted, 0.0) * 1000))
+	parts.append('total;dur=%.2f' % (total * 1000))
+	return ', '.join(parts)
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+	'qaapi_requests_total', 'Requests served, by route, method and status.', ('route', 'method', 'status')))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+	'qaapi_request_errors_total', 'Requests answered with a 5xx status, by route.', ('route',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+	'qaapi_request_duration_seconds', 'Time to produce a response, by route.', ('route',)))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+	'qaapi_upstream_duration_seconds', 'Market Maker response time up to the response headers, by method and top level resource.', ('method', 'resource')))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+	'qaapi_upstream_errors_total', 'Market Maker calls that failed or returned a 5xx status.', ('method', 'resource')))
+UPSTREAM_REJECTED = REGISTRY.register(Counter(
+	'qaapi_upstream_rejected_total', 'Market Maker calls refused before being sent, by reason (circuit_open, bulkhead) and route class.', ('reason', 'route_class')))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+	'qaapi_upstream_hedges_total', 'Hedged GETs, by which of the two calls answered first (primary, hedge).', ('winner',)))
+NODE_SECONDS = REGISTRY.register(Histogram(
+	'qaapi_node_call_duration_seconds', 'Time spent in bos_mint Node calls, by call.', ('call',)))
+NODE_ERRORS = REGISTRY.register(Counter(
+	'qaapi_node_call_errors_total', 'bos_mint Node calls that raised, by call.', ('call',)))
+BROADCAST_SECONDS = REGISTRY.register(Histogram(
+	'qaapi_node_broadcast_duration_seconds', 'Time spent broadcasting transactions to the witness node, by call.', ('call',)))
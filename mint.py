@@ -1,70 +1,423 @@
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
 from flask import make_response
 from flask import jsonify
-from bos_mint.node import Node
+import metrics
+import witnesses
 
 # MINT calls
 # TODO add account param for bookie object creation/update proposals
 
+# One Node per process. bos_mint keeps the pending proposal on the Node class
+# and the chain connection in the shared peerplays instance, so every queue and
+# broadcast runs under _lock to keep concurrent requests out of each other's
+# transactions.
+_lock = threading.RLock()
+_node = None
+# set by useWitnesses: witness nodes ranked by probe round trip, and the one
+# the shared peerplays instance is connected to
+_witnesses = None
+_node_url = None
+# where bos_mint reads its witness nodes from, for reconnecting without _witnesses
+_bos_mint_config = 'config-bos-mint.yaml'
+_latency = {}
+_broadcasts = 0
+
+# exception names bos_mint folds into the NodeException message when the
+# witness connection, rather than the operation, failed
+CONNECTION_ERRORS = (
+	'NumRetriesReached',
+	'RPCConnection',
+	'WebSocketConnectionClosedException',
+	'WebSocketTimeoutException',
+	'ConnectionError',
+	'ConnectionRefusedError',
+	'ConnectionResetError',
+	'BrokenPipeError',
+	'TimeoutError'
+)
+
+def node():
+	with _lock:
+		if _node is None:
+			connect()
+		return _node
+
+def connect():
+	"""
+	Create the process-wide Node and open its witness connection.
+	"""
+	global _node
+	with _lock:
+		if _node is None:
+			# imported here so that proxy-only servers never load bos_mint,
+			# peerplays and SQLAlchemy
+			from bos_mint.node import Node
+			_node = Node()
+			instance = _node.get_node()
+			if _witnesses is not None:
+				# Node connects in config order; move to the fastest healthy node
+				_witnesses.probeAll()
+				_connectTo(instance, _witnesses.ranked(), _witnesses.num_retries)
+				_witnesses.start(_rebalance)
+			atexit.register(close)
+		return _node
+
+def useWitnesses(witness_nodes):
+	"""
+	Route MINT calls to the best of ``witness_nodes``, a
+	witnesses.WitnessNodes, from the next connection on.
+	"""
+	global _witnesses
+	with _lock:
+		_witnesses = witness_nodes
+
+def useBosMintConfig(path):
+	"""
+	Read the witness nodes to reconnect to from the config-bos-mint.yaml at
+	``path``, the file bos_mint itself was configured with.
+	"""
+	global _bos_mint_config
+	with _lock:
+		_bos_mint_config = path
+
+def _connectTo(instance, urls, num_retries):
+	"""
+	Reconnect the shared peerplays instance to ``urls``, best first. Its rpc
+	client moves down the list when a node cannot be reached.
+	"""
+	global _node_url
+	try:
+		instance.rpc.connection.disconnect()
+	except Exception:
+		pass
+	instance.connect(node=urls, num_retries=num_retries)
+	_node_url = urls[0]
+
+def _rebalance():
+	"""
+	After a round of probes, move to a faster node, or away from one that
+	stopped answering or fell behind. Waits for the MINT call in progress.
+	"""
+	if _witnesses is None or _node_url is None or not _witnesses.better(_node_url):
+		return
+	with _lock:
+		if _node is None or _node_url is None:
+			return
+		_connectTo(_node.get_node(), _witnesses.ranked(), _witnesses.num_retries)
+		_witnesses.switched()
+
+def useNode(instance):
+	"""
+	Make ``instance``, e.g. a chainsim.SimulatedNode, the process-wide Node
+	in place of one connected to a witness node.
+	"""
+	global _node
+	with _lock:
+		_node = instance
+		return _node
+
+def close():
+	"""
+	Drop any half-built transaction and disconnect from the witness node.
+	"""
+	global _node, _node_url
+	with _lock:
+		if _node is None:
+			return
+		try:
+			_node.discardPendingTransaction()
+			rpc = _node.get_node().rpc
+			if rpc is not None:
+				rpc.connection.disconnect()
+		except Exception:
+			pass
+		_node = None
+		_node_url = None
+
+def reconnect():
+	with _lock:
+		instance = node().get_node()
+		if _witnesses is not None and _node_url is not None:
+			# fail over to the next best node rather than retry the one that failed
+			_witnesses.failed(_node_url)
+			_connectTo(instance, _witnesses.ranked(), _witnesses.num_retries)
+			_witnesses.switched()
+			return
+		# peerplays falls back to its own config store, which knows no node
+		# unless bos_mint was set up through it, so pass the nodes explicitly
+		urls, num_retries = witnesses.nodesOf(_bos_mint_config)
+		_connectTo(instance, urls, num_retries)
+
+def isConnectionError(e):
+	if isinstance(e, (ConnectionError, TimeoutError)):
+		return True
+	message = str(e)
+	return e.__class__.__name__ in CONNECTION_ERRORS or message.startswith(CONNECTION_ERRORS)
+
+def _record(name, started, failed):
+	elapsed = time.monotonic() - started
+	entry = _latency.get(name)
+	if entry is None:
+		entry = _latency[name] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+	entry["calls"] += 1
+	if failed:
+		entry["errors"] += 1
+	entry["total_ms"] += elapsed * 1000
+	entry["max_ms"] = max(entry["max_ms"], elapsed * 1000)
+	metrics.NODE_SECONDS.observe(elapsed, name)
+	metrics.addTiming('upstream', elapsed)
+	if failed:
+		metrics.NODE_ERRORS.inc(name)
+
+def _broadcasted():
+	global _broadcasts
+	_broadcasts += 1
+
+def broadcastCount():
+	"""
+	Number of transactions this process has broadcast, for caches of chain
+	state to notice they may be stale.
+	"""
+	return _broadcasts
+
+def _timed(name, fn, *args):
+	"""
+	Run ``fn``, a call that broadcasts to the witness node, recording its
+	time as broadcast time.
+	"""
+	started = time.monotonic()
+	try:
+		return fn(*args)
+	finally:
+		metrics.BROADCAST_SECONDS.observe(time.monotonic() - started, name)
+
+def _call(name, fn):
+	waited = time.monotonic()
+	with _lock:
+		started = time.monotonic()
+		# requests queue on the Node lock behind other MINT calls
+		metrics.addTiming('queue', started - waited)
+		try:
+			result = fn()
+		except Exception as e:
+			_record(name, started, True)
+			if isConnectionError(e):
+				try:
+					reconnect()
+				except Exception:
+					# the caller gets the error of the call; the next call retries the connection
+					pass
+			raise
+		_record(name, started, False)
+		return result
+
+def _broadcast(name, *args):
+	"""
+	Queue one proposed operation on the shared Node and broadcast it.
+	"""
+	def queueAndBroadcast():
+		try:
+			getattr(node(), name)(*args)
+			result = _timed(name, node().broadcastPendingTransaction)
+		except Exception:
+			node().discardPendingTransaction()
+			raise
+		_broadcasted()
+		return result
+	return _call(name, queueAndBroadcast)
+
+def _chunks(operations, max_ops, max_bytes):
+	"""
+	Split operation indexes into groups that fit one transaction, sizing each
+	operation by its JSON arguments, which overstates the serialized size.
+	"""
+	chunk = []
+	size = 0
+	for index, (name, args) in enumerate(operations):
+		op_size = len(json.dumps(args, default=str)) + 64
+		if chunk and (len(chunk) >= max_ops or size + op_size > max_bytes):
+			yield chunk
+			chunk = []
+			size = 0
+		chunk.append(index)
+		size += op_size
+	if chunk:
+		yield chunk
+
+def batch(operations, max_ops=50, max_bytes=16384):
+	"""
+	Queue ``operations``, a list of ``(name, args)`` pairs naming Node methods,
+	and broadcast them in as few transactions as the size limits allow.
+	Returns the broadcast transactions and one result per operation, in input
+	order, holding either the index of its transaction or an error.
+	"""
+	transactions = []
+	results = [None] * len(operations)
+	for chunk in _chunks(operations, max_ops, max_bytes):
+		def queueAndBroadcast():
+			queued = []
+			try:
+				for index in chunk:
+					name, args = operations[index]
+					try:
+						getattr(node(), name)(*args)
+						queued.append(index)
+					except Exception as e:
+						results[index] = {"error": str(e)}
+				if not queued:
+					return
+				transaction = _timed('batch', node().broadcastPendingTransaction)
+				_broadcasted()
+			except Exception as e:
+				node().discardPendingTransaction()
+				for index in queued:
+					results[index] = {"error": str(e)}
+				raise
+			for index in queued:
+				results[index] = {"transaction": len(transactions)}
+			transactions.append(transaction)
+		try:
+			_call('batch', queueAndBroadcast)
+		except Exception:
+			# recorded per operation, the remaining chunks still go out
+			pass
+	return transactions, results
+
+def propose(operations):
+	"""
+	Queue ``operations`` in one proposal and broadcast it. Operations may
+	refer to objects created earlier in the list by relative id ``0.0.<n>``,
+	``n`` being the position in the list. Nothing is broadcast unless every
+	operation queues.
+	"""
+	def queueAndBroadcast():
+		try:
+			for name, args in operations:
+				getattr(node(), name)(*args)
+			result = _timed('propose', node().broadcastPendingTransaction)
+		except Exception:
+			node().discardPendingTransaction()
+			raise
+		_broadcasted()
+		return result
+	return _call('propose', queueAndBroadcast)
+
+def approveProposals(proposal_ids, approve, max_ops=50):
+	"""
+	Approve, or reject, many proposals with as few transactions as possible,
+	``max_ops`` proposal updates to a transaction. A transaction that fails is
+	split in halves and retried, so one bad id only costs its own outcome.
+	Returns the transactions and one result per proposal id, in input order.
+	"""
+	transactions = []
+	results = {}
+
+	def vote(chunk):
+		instance = node().get_node()
+		account = node().getSelectedAccountName()
+		if approve is True:
+			result = _timed('approveProposals', instance.approveproposal, chunk, account, account)
+		else:
+			result = _timed('approveProposals', instance.disapproveproposal, chunk, account, account)
+		_broadcasted()
+		return result
+
+	def send(chunk):
+		try:
+			transaction = _call('approveProposals', lambda: vote(chunk))
+		except Exception as e:
+			if len(chunk) == 1:
+				results[chunk[0]] = {"error": str(e)}
+				return
+			middle = len(chunk) // 2
+			send(chunk[:middle])
+			send(chunk[middle:])
+			return
+		for proposal_id in chunk:
+			results[proposal_id] = {"transaction": len(transactions)}
+		transactions.append(transaction)
+
+	unique = list(OrderedDict.fromkeys(proposal_ids))
+	for start in range(0, len(unique), max_ops):
+		send(unique[start:start + max_ops])
+	return transactions, [dict(results[proposal_id], id=proposal_id) for proposal_id in proposal_ids]
+
+def getBinnedOrderBook(betting_market_id, precision):
+	return _call('getBinnedOrderBook', lambda: node().get_node().rpc.get_binned_order_book(betting_market_id, precision, api="bookie"))
+
+def getAccountId(account):
+	def lookup():
+		result = node().get_node().rpc.get_account_by_name(account)
+		if result is None:
+			raise ValueError("unknown account " + account)
+		return result['id']
+	return _call('getAccountId', lookup)
+
+def getAccountHistory(account_id, stop, limit, start):
+	return _call('getAccountHistory', lambda: node().get_node().rpc.get_account_history(account_id, stop, limit, start, api="history"))
+
+def stats():
+	with _lock:
+		calls = {}
+		for name, entry in _latency.items():
+			calls[name] = dict(entry, avg_ms=entry["total_ms"] / entry["calls"])
+		return {"connected": _node is not None, "node": _node_url, "witnesses": _witnesses.stats() if _witnesses is not None else None, "calls": calls}
+
 def createSport(name):
-	Node().createSport(name)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('createSport', name)
 
 def updateSport(sportId, name):
-	Node().updateSport(sportId, name)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateSport', sportId, name)
 
 def createEventGroup(name, sportId):
-	Node().createEventGroup(name, sportId)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('createEventGroup', name, sportId)
 
 def updateEventGroup(eventGroupId, name, sportId):
-	Node().updateEventGroup(eventGroupId, name, sportId)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateEventGroup', eventGroupId, name, sportId)
 
 def createEvent(name, season, startTime, eventGroupId):
-	Node().createEvent(name, season, startTime, eventGroupId)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('createEvent', name, season, startTime, eventGroupId)
 
 def updateEvent(eventId, name, season, startTime, eventGroupId, status):
-	Node().updateEvent(eventId, name, season, startTime, eventGroupId, status)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateEvent', eventId, name, season, startTime, eventGroupId, status)
 
 def updateEventStatus(eventId, status, scores=[]):
-	Node().updateEventStatus(eventId, status, scores)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateEventStatus', eventId, status, scores)
 
 def createBettingMarketGroup(description, eventId, bettingMarketRuleId, asset):
-	Node().createBettingMarketGroup(description, eventId, bettingMarketRuleId, asset)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('createBettingMarketGroup', description, eventId, bettingMarketRuleId, asset)
 
 def updateBettingMarketGroup(bmgId, description, eventId, rulesId, status):
-	Node().updateBettingMarketGroup(bmgId, description, eventId, rulesId, status)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateBettingMarketGroup', bmgId, description, eventId, rulesId, status)
 
 def updateBettingMarketGroupRule(bmgrId, name, description):
-	Node().updateBettingMarketGroupRule(bmgrId, name, description)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateBettingMarketGroupRule', bmgrId, name, description)
 
 def createBettingMarket(payoutCondition, description, bettingMarketGroupId):
-	Node().createBettingMarket(payoutCondition, description, bettingMarketGroupId)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('createBettingMarket', payoutCondition, description, bettingMarketGroupId)
 
 def updateBettingMarket(bmId, payout_condition, description, bmgId):
-	Node().updateBettingMarket(bmId, payout_condition, description, bmgId)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('updateBettingMarket', bmId, payout_condition, description, bmgId)
 
 def resolveBettingMarketGroup(bettingMarketGroupId, resultList):
-	Node().resolveBettingMarketGroup(bettingMarketGroupId, resultList)
-	return Node().broadcastPendingTransaction()
+	return _broadcast('resolveBettingMarketGroup', bettingMarketGroupId, resultList)
 
 def getProposals(account=None):
 	if account is None:
-		return Node().getAllProposals()
+		return _call('getProposals', lambda: node().getAllProposals())
 	else:
-		return Node().getAllProposals(accountName=account)
+		return _call('getProposals', lambda: node().getAllProposals(accountName=account))
 
 def approveProposal(proposal_id, approve):
-	if approve is True:
-		return Node().acceptProposal(proposal_id)
-	else:
-		return Node().rejectProposal(proposal_id)
+	def vote():
+		if approve is True:
+			result = _timed('approveProposal', node().acceptProposal, proposal_id)
+		else:
+			result = _timed('approveProposal', node().rejectProposal, proposal_id)
+		_broadcasted()
+		return result
+	return _call('approveProposal', vote)
@@ -0,0 +1,126 @@
+import threading
+import time
+
+# Order books
+# Back and lay depth of the betting markets clients are reading, held in memory
+# and refreshed by a background thread so a read never waits on the chain once
+# a market is being watched.
+
+def aggregate(bets):
+	"""
+	Sum bet amounts per odds level, in ascending backer_multiplier order.
+	"""
+	levels = {}
+	for bet in bets:
+		multiplier = bet['backer_multiplier']
+		levels[multiplier] = levels.get(multiplier, 0) + bet['amount_to_bet']
+	return [{"backer_multiplier": multiplier, "amount": levels[multiplier]} for multiplier in sorted(levels)]
+
+class OrderBooks(object):
+
+	def __init__(self, fetch, config):
+		"""
+		``fetch(betting_market_id)`` returns the binned order book of a market
+		as the chain's bookie API does.
+		"""
+		self.fetch = fetch
+		self.refresh_interval = config.get('refresh_interval', 0.5)
+		self.watch_for = config.get('watch_for', 60)
+		self.touch_interval = config.get('touch_interval', 0.1)
+		self.books = {}
+		self.watched = {}
+		self.touched = set()
+		self.refreshed = {}
+		self.lock = threading.Lock()
+		self.wake = threading.Event()
+		self.thread = None
+		self.refreshes = 0
+		self.changes = 0
+		self.errors = 0
+
+	def _refresh(self, betting_market_id):
+		with self.lock:
+			self.refreshed[betting_market_id] = time.monotonic()
+		binned = self.fetch(betting_market_id)
+		book = {
+			"betting_market_id": betting_market_id,
+			"back": aggregate(binned.get('aggregated_back_bets', [])),
+			"lay": aggregate(binned.get('aggregated_lay_bets', []))
+		}
+		with self.lock:
+			self.refreshes += 1
+			current = self.books.get(betting_market_id)
+			if current is None or current[0] != book:
+				self.changes += 1
+				self.books[betting_market_id] = (book, time.time())
+			else:
+				self.books[betting_market_id] = (current[0], time.time())
+
+	def get(self, betting_market_id):
+		"""
+		The book of a market and the unix time it was last confirmed. The first
+		read of a market fetches it; later reads come from memory while the
+		background thread keeps it current.
+		"""
+		with self.lock:
+			self.watched[betting_market_id] = time.monotonic()
+			entry = self.books.get(betting_market_id)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._run, name='orderbook-refresh')
+				self.thread.daemon = True
+				self.thread.start()
+		if entry is None:
+			self._refresh(betting_market_id)
+			with self.lock:
+				entry = self.books[betting_market_id]
+		return entry
+
+	def touch(self, betting_market_id):
+		"""
+		Note that a market's book just changed, e.g. a bet was placed in it
+		through this API, so that market alone is refreshed without waiting
+		for the interval, at most once every ``touch_interval`` seconds.
+		"""
+		with self.lock:
+			if betting_market_id in self.watched:
+				self.touched.add(betting_market_id)
+				self.wake.set()
+
+	def _run(self):
+		next_round = time.monotonic() + self.refresh_interval
+		wake_at = next_round
+		while True:
+			self.wake.wait(max(0, wake_at - time.monotonic()))
+			self.wake.clear()
+			now = time.monotonic()
+			with self.lock:
+				if now >= next_round:
+					for betting_market_id, last_read in list(self.watched.items()):
+						if now - last_read > self.watch_for:
+							del self.watched[betting_market_id]
+							self.books.pop(betting_market_id, None)
+							self.refreshed.pop(betting_market_id, None)
+					markets = list(self.watched.keys())
+					self.touched.clear()
+					next_round = now + self.refresh_interval
+				else:
+					self.touched &= set(self.watched)
+					markets = [betting_market_id for betting_market_id in self.touched if now - self.refreshed.get(betting_market_id, 0) >= self.touch_interval]
+					self.touched.difference_update(markets)
+				# touched markets refreshed too recently wait for their turn
+				wake_at = min([next_round] + [self.refreshed.get(betting_market_id, 0) + self.touch_interval for betting_market_id in self.touched])
+			for betting_market_id in markets:
+				try:
+					self._refresh(betting_market_id)
+				except Exception:
+					with self.lock:
+						self.errors += 1
+
+	def stats(self):
+		with self.lock:
+			return {
+				"watched": len(self.watched),
+				"refreshes": self.refreshes,
+				"changes": self.changes,
+				"errors": self.errors
+			}
@@ -0,0 +1,167 @@
+import bisect
+import re
+import threading
+import time
+
+# Proposal index
+# Keeps the open proposals of each account in memory, indexed by proposer,
+# operation type, referenced object id and expiration, so /proposals can filter
+# and page without shipping every proposal on every call.
+
+OBJECT_ID = re.compile(r'^\d+\.\d+\.\d+$')
+
+def instance(object_id):
+	return int(object_id.rsplit('.', 1)[1])
+
+def referencedObjects(value, found=None):
+	"""
+	Object ids (``1.18.5``) appearing anywhere in an operation, fees excluded.
+	"""
+	if found is None:
+		found = set()
+	if isinstance(value, dict):
+		for key, item in value.items():
+			if key != 'fee':
+				referencedObjects(item, found)
+	elif isinstance(value, (list, tuple)):
+		for item in value:
+			referencedObjects(item, found)
+	elif isinstance(value, str) and OBJECT_ID.match(value):
+		found.add(value)
+	return found
+
+class _Index(object):
+
+	def __init__(self):
+		self.proposals = {}
+		self.by_proposer = {}
+		self.by_op = {}
+		self.by_object = {}
+		self.by_expiration = []
+		self.refreshed = 0.0
+		self.version = None
+
+	def _keys(self, proposal):
+		operations = proposal.get('proposed_transaction', {}).get('operations', [])
+		ops = set(op[0] for op in operations)
+		objects = set()
+		for op in operations:
+			referencedObjects(op[1], objects)
+		return ops, objects
+
+	def _add(self, proposal):
+		proposal_id = proposal['id']
+		self.proposals[proposal_id] = proposal
+		ops, objects = self._keys(proposal)
+		self.by_proposer.setdefault(proposal.get('proposer'), set()).add(proposal_id)
+		for op in ops:
+			self.by_op.setdefault(op, set()).add(proposal_id)
+		for object_id in objects:
+			self.by_object.setdefault(object_id, set()).add(proposal_id)
+		bisect.insort(self.by_expiration, (proposal.get('expiration_time', ''), instance(proposal_id), proposal_id))
+
+	def _remove(self, proposal_id):
+		proposal = self.proposals.pop(proposal_id)
+		ops, objects = self._keys(proposal)
+		self._discard(self.by_proposer, proposal.get('proposer'), proposal_id)
+		for op in ops:
+			self._discard(self.by_op, op, proposal_id)
+		for object_id in objects:
+			self._discard(self.by_object, object_id, proposal_id)
+		entry = (proposal.get('expiration_time', ''), instance(proposal_id), proposal_id)
+		position = bisect.bisect_left(self.by_expiration, entry)
+		if position < len(self.by_expiration) and self.by_expiration[position] == entry:
+			del self.by_expiration[position]
+
+	def _discard(self, index, key, proposal_id):
+		ids = index.get(key)
+		if ids is not None:
+			ids.discard(proposal_id)
+			if not ids:
+				del index[key]
+
+	def update(self, proposals):
+		"""
+		Apply a fresh proposal listing: new and changed proposals are
+		(re)indexed, ones no longer open are dropped, the rest are left alone.
+		"""
+		seen = set()
+		for proposal in proposals:
+			proposal = dict(proposal)
+			proposal_id = proposal['id']
+			seen.add(proposal_id)
+			current = self.proposals.get(proposal_id)
+			if current == proposal:
+				continue
+			if current is not None:
+				self._remove(proposal_id)
+			self._add(proposal)
+		for proposal_id in list(self.proposals.keys()):
+			if proposal_id not in seen:
+				self._remove(proposal_id)
+
+class ProposalStore(object):
+
+	def __init__(self, fetch, version, config):
+		"""
+		``fetch(account)`` lists the open proposals of an account and
+		``version()`` changes whenever a broadcast may have changed them.
+		"""
+		self.fetch = fetch
+		self.version = version
+		self.refresh_interval = config.get('refresh_interval', 5)
+		self.max_limit = config.get('max_limit', 500)
+		self.indexes = {}
+		self.lock = threading.Lock()
+		self.refreshes = 0
+
+	def index(self, account):
+		with self.lock:
+			index = self.indexes.get(account)
+			if index is None:
+				index = self.indexes[account] = _Index()
+			version = self.version()
+			if index.version != version or time.monotonic() - index.refreshed >= self.refresh_interval:
+				index.update(self.fetch(account))
+				index.refreshed = time.monotonic()
+				index.version = version
+				self.refreshes += 1
+			return index
+
+	def query(self, account=None, op=None, object_id=None, proposer=None, expiring_before=None, cursor=None, limit=None):
+		"""
+		Open proposals matching every given filter, in id order, starting
+		after the ``cursor`` proposal id. Returns the page and the cursor of
+		the next page, or None on the last page.
+		"""
+		index = self.index(account)
+		with self.lock:
+			candidates = None
+			for ids in (
+					index.by_op.get(op, set()) if op is not None else None,
+					index.by_object.get(object_id, set()) if object_id is not None else None,
+					index.by_proposer.get(proposer, set()) if proposer is not None else None):
+				if ids is None:
+					continue
+				candidates = set(ids) if candidates is None else candidates & ids
+			if expiring_before is not None:
+				end = bisect.bisect_left(index.by_expiration, (expiring_before,))
+				expiring = set(entry[2] for entry in index.by_expiration[:end])
+				candidates = expiring if candidates is None else candidates & expiring
+			if candidates is None:
+				candidates = index.proposals.keys()
+			ordered = sorted(candidates, key=instance)
+			if cursor is not None:
+				ordered = [proposal_id for proposal_id in ordered if instance(proposal_id) > instance(cursor)]
+			limit = min(limit or self.max_limit, self.max_limit)
+			page = [index.proposals[proposal_id] for proposal_id in ordered[:limit]]
+			next_cursor = page[-1]['id'] if len(ordered) > limit else None
+			return page, next_cursor
+
+	def stats(self):
+		with self.lock:
+			return {
+				"accounts": len(self.indexes),
+				"proposals": sum(len(index.proposals) for index in self.indexes.values()),
+				"refreshes": self.refreshes
+			}
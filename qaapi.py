@@ -1,19 +1,248 @@
 import json
+import os
+import time
 import yaml
 from flask import Flask
 from flask import request
 from flask import make_response
-import requests
+from flask import Response
+from flask import stream_with_context
 from flask import redirect
 from flask import jsonify
+from flask import g
 from datetime import datetime
-from peerplays import PeerPlays
-from peerplaysbase import operations
-from peerplays.amount import Amount
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from urllib.parse import urlencode
+from werkzeug.http import generate_etag
 import mint
+import upstream
+import cache
+import proposals
+import orderbook
+import history
+import compression
+import metrics
+import witnesses
 
 app = Flask(__name__)
 
+# routes answered by relaying the request to the Market Maker unchanged
+PROXY_ENDPOINTS = frozenset([
+	'placeBets',
+	'placeSingleBet',
+	'cancelBet',
+	'cancelBets',
+	'getMatchedBets',
+	'getUnmatchedBets',
+	'getSport',
+	'getSports',
+	'getEventGroup',
+	'getEventGroups',
+	'getEvent',
+	'getEvents',
+	'getBettingMarketGroup',
+	'getBettingMarketGroups',
+	'getBettingMarketByQuery',
+	'getBettingMarket',
+	'getBettingMarkets',
+	'getRules',
+	'getHistory',
+	'getAccountDetails'
+])
+
+# routes that read or write the chain through a witness node, refused when
+# server.proxy_only is set
+MINT_ENDPOINTS = frozenset([
+	'getOrderBook',
+	'createSport',
+	'updateSport',
+	'createEventGroup',
+	'updateEventGroup',
+	'createEvent',
+	'updateEvent',
+	'updateEventStatus',
+	'createBettingMarketGroup',
+	'updateBettingMarketGroup',
+	'updateBettingMarketGroupRule',
+	'createBettingMarket',
+	'updateBettingMarket',
+	'resolveBettingMarketGroup',
+	'getProposals',
+	'approveProposals',
+	'approveProposal',
+	'mintBatch',
+	'mintTree'
+])
+
+# read-only sports hierarchy routes and the resource type they are cached under
+CACHED_ENDPOINTS = {
+	'getSport': 'sports',
+	'getSports': 'sports',
+	'getEventGroup': 'eventGroups',
+	'getEventGroups': 'eventGroups',
+	'getEvent': 'events',
+	'getEvents': 'events',
+	'getBettingMarketGroup': 'bettingMarketGroups',
+	'getBettingMarketGroups': 'bettingMarketGroups',
+	'getBettingMarketByQuery': 'bettingMarkets',
+	'getBettingMarket': 'bettingMarkets',
+	'getBettingMarkets': 'bettingMarkets',
+	'getRules': 'rules'
+}
+
+def fetchUpstream(method, full_path, body=None, resource=None):
+	"""
+	Buffered Market Maker call returning ``(content, status, headers)``.
+	Successful reads of a cached ``resource`` are served from and stored in
+	the response cache, and identical GETs in flight at the same time share
+	one upstream call. A HEAD is answered from a cached GET or sent upstream
+	as a GET, whose body the server drops, and is never stored.
+	"""
+	head = method == 'HEAD'
+	if head:
+		method = 'GET'
+	if resource is not None and method == 'GET':
+		cached = response_cache.get(full_path)
+		if cached is not None:
+			return cached
+
+	def fetch():
+		response = market_maker.request(method, full_path, json = body)
+		result = (response.content, response.status_code, upstream.forwardHeaders(response))
+		if resource is not None and not head and response.status_code == 200:
+			# hashed once here rather than on every cache hit
+			result = upstream.withEtag(result)
+			response_cache.set(full_path, resource, result)
+		return result
+
+	if method == 'GET' and not head and market_maker.coalesce:
+		return in_flight.do(full_path, fetch)
+	return fetch()
+
+def upstreamJson(path, resource=None):
+	"""
+	GET ``path`` from the Market Maker as parsed JSON, keyed in the cache like
+	the proxied route for the same path. Raises upstream.UpstreamError with
+	the upstream response when it is not a 200.
+	"""
+	content, status, headers = fetchUpstream('GET', path + '?', resource=resource)
+	if status != 200:
+		raise upstream.UpstreamError(content, status, headers)
+	return json.loads(content)
+
+def proxy():
+	"""
+	Forward the current request to the Market Maker over the pooled session
+	and relay its response. Endpoints listed in ``market-maker.stream_endpoints``
+	pass the upstream body through chunk by chunk instead of buffering it, and
+	successful reads of the sports hierarchy are served from the response cache
+	until their TTL runs out or an approval invalidates them. Identical GETs
+	in flight at the same time share one upstream call.
+
+	A ``fields`` query param, e.g. ``fields=balances,id``, is not forwarded:
+	the full response is fetched (and cached) as usual and trimmed to those
+	fields before it is sent.
+	"""
+	query_string, fields = upstream.splitFields(request.query_string.decode('utf-8'))
+	if fields:
+		full_path = request.path + '?' + query_string
+		result = fetchUpstream(request.method, full_path, request.get_json(silent=True), CACHED_ENDPOINTS.get(request.endpoint))
+		return upstream.projectResult(result, fields)
+	if request.endpoint in market_maker.stream_endpoints:
+		# the raw body is relayed as is, so only ask for encodings the client accepts
+		headers = {'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')}
+		response, release = market_maker.stream(request.method, request.full_path, json = request.get_json(silent=True), headers = headers)
+		body = stream_with_context(upstream.iterBody(response, market_maker.chunk_size, release))
+		relay = Response(body, response.status_code, upstream.forwardHeaders(response, encoded=True), direct_passthrough=True)
+		# a HEAD, 204 or 304 is closed without the body being read
+		relay.call_on_close(response.close)
+		relay.call_on_close(release)
+		return relay
+	return fetchUpstream(request.method, request.full_path, request.get_json(silent=True), CACHED_ENDPOINTS.get(request.endpoint))
+
+@app.errorhandler(upstream.UpstreamError)
+def upstreamError(e):
+	"""
+	Relay a Market Maker error, or the 503/504 JSON error of a call that was
+	refused, timed out or could not connect.
+	"""
+	return e.response()
+
+@app.before_request
+def startTimer():
+	g.started = time.perf_counter()
+	g.timings = metrics.startTimings()
+	# time spent waiting for a worker thread, when the asyncio engine runs this app
+	queued = request.environ.get('qaapi.queue_seconds')
+	if queued is not None:
+		metrics.addTiming('queue', queued)
+	if request.is_json:
+		parse_started = time.perf_counter()
+		# cached on the request, so views get it for free
+		request.get_json(silent=True)
+		metrics.addTiming('parse', time.perf_counter() - parse_started)
+
+@app.before_request
+def rejectMint():
+	"""
+	In proxy-only mode, answer MINT routes without touching bos_mint, which
+	is then never imported.
+	"""
+	if proxy_only and request.endpoint in MINT_ENDPOINTS:
+		return make_response(jsonify(error="MINT routes are disabled on this server (server.proxy_only)"), 503)
+
+# registered first, so it runs after every other after_request hook
+@app.after_request
+def recordMetrics(response):
+	route = request.endpoint or 'unmatched'
+	started = g.get('started')
+	if started is not None:
+		total = time.perf_counter() - started
+		metrics.REQUEST_SECONDS.observe(total, route)
+		if server_timing:
+			response.headers['Server-Timing'] = metrics.serverTiming(g.timings, total)
+	metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+	if response.status_code >= 500:
+		metrics.REQUEST_ERRORS.inc(route)
+	return response
+
+@app.after_request
+def compressResponse(response):
+	"""
+	Compress buffered JSON responses with the best encoding the client
+	accepts. Streamed bodies are relayed in whatever encoding the Market
+	Maker chose and are left alone, as is anything already encoded.
+	"""
+	if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+		return response
+	if not compressor.compressible(response.mimetype, response.calculate_content_length() or 0):
+		return response
+	response.vary.add('Accept-Encoding')
+	encoding = compressor.negotiate(request.headers.get('Accept-Encoding'))
+	if encoding is not None:
+		response.set_data(compressor.compress(response.get_data(), encoding))
+		response.headers['Content-Encoding'] = encoding
+	return response
+
+# registered after compressResponse, so it runs first and sees the plain body
+@app.after_request
+def conditionalResponse(response):
+	"""
+	Tag successful buffered reads with a weak ETag, reusing the one stored
+	with a cached response, and answer ``304 Not Modified`` when it matches
+	the client's ``If-None-Match``.
+	"""
+	if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+		return response
+	if response.direct_passthrough or response.is_streamed:
+		return response
+	if 'ETag' not in response.headers:
+		started = time.perf_counter()
+		response.set_etag(generate_etag(response.get_data()), weak=True)
+		metrics.addTiming('serialize', time.perf_counter() - started)
+	return response.make_conditional(request)
+
 @app.route("/placeBets", methods=['POST'])
 def placeBets():
 	"""
@@ -73,8 +302,13 @@ def placeBets():
          	 ]
 
 	"""
-	response = requests.post(market_maker_url + request.full_path, json = request.get_json())
-	return (response.content, response.status_code, response.headers.items())
+	result = proxy()
+	bets = request.get_json(silent=True)
+	if isinstance(bets, list):
+		for bet in bets:
+			if isinstance(bet, dict):
+				order_books.touch(bet.get('betting_market_id'))
+	return result
 
 @app.route("/placeSingleBet", methods=['POST'])
 def placeSingleBet():
@@ -115,8 +349,11 @@ def placeSingleBet():
 			}
 
 	"""
-	response = requests.post(market_maker_url + request.full_path, json = request.get_json())
-	return (response.content, response.status_code, response.headers.items())
+	result = proxy()
+	bet = request.get_json(silent=True)
+	if isinstance(bet, dict):
+		order_books.touch(bet.get('betting_market_id'))
+	return result
 
 @app.route("/bets/<bet_id>", methods=['DELETE'])
 def cancelBet(bet_id):
@@ -163,9 +400,7 @@ def cancelBet(bet_id):
 			}
 
 	"""
-	# TODO cancel by event id, bmg id
-	response = requests.delete(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/bets", methods=['DELETE'])
 def cancelBets():
@@ -242,9 +477,147 @@ def cancelBets():
 			]
 
 	"""
-	# TODO cancel by event id, bmg id
-	response = requests.delete(market_maker_url + request.full_path, json = request.get_json())
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
+
+def cancelBetsInMarkets(account, markets, unmatched):
+	"""
+	Cancel every unmatched bet of ``account`` placed in one of ``markets`` with
+	a single **DELETE** ``/bets`` to the Market Maker, relaying its response.
+	"""
+	ids = [bet['id'] for bet in unmatched if bet['betting_market_id'] in markets]
+	if not ids:
+		return jsonify([])
+	return fetchUpstream('DELETE', '/bets?' + urlencode({'account': account}), {"ids": ids})
+
+@app.route("/bettingMarketGroups/<bmg_id>/bets", methods=['DELETE'])
+def cancelBettingMarketGroupBets(bmg_id):
+	"""
+	**DELETE** ``/bettingMarketGroups/<bmg_id>/bets``
+
+	Cancels all unmatched bets of the account in the betting markets of the
+	group. The bets are looked up server side and cancelled in one call to
+	the Market Maker.
+
+	* query-params:
+		+ account:
+			- type: string
+			- description: account name or account id
+			- required: True
+
+	* path-params:
+		+ bmg_id:
+			- type: string
+			- description: betting market group id
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			[
+			    {
+			        "expiration": "2018-07-26T05:11:48",
+			        "extensions": [],
+			        "operations": [
+			            [
+			                68,
+			                {
+			                    "bet_to_cancel": "1.22.1166",
+			                    "bettor_id": "1.2.104",
+			                    "extensions": [],
+			                    "fee": {
+			                        "amount": 0,
+			                        "asset_id": "1.3.0"
+			                    }
+			                }
+			            ]
+			        ],
+			        "ref_block_num": 20203,
+			        "ref_block_prefix": 1203983718,
+			        "signatures": [
+			            "1f616b8f816ba2abb31ba17d57a02be50a86b58ebc6e44ebe9b0d1ce881c3c54db09a9fa18142ef6ff5faacddf6b2767b59390acb9907dd366ca67788d96d91881"
+			        ]
+			    }
+			]
+
+	"""
+	try:
+		account = request.args.get("account")
+		if account is None:
+			return make_response(jsonify(error="Specify account in query params"), 500)
+		unmatched = fanout.submit(upstreamJson, '/bettors/%s/unmatchedBets' % quote(account))
+		markets = set(market['id'] for market in upstreamJson('/bettingMarketGroups/%s/bettingMarkets' % quote(bmg_id), 'bettingMarkets'))
+		return cancelBetsInMarkets(account, markets, unmatched.result())
+	except upstream.UpstreamError as e:
+		return e.response()
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
+
+@app.route("/events/<event_id>/bets", methods=['DELETE'])
+def cancelEventBets(event_id):
+	"""
+	**DELETE** ``/events/<event_id>/bets``
+
+	Cancels all unmatched bets of the account in every betting market of the
+	event. The bets are looked up server side and cancelled in one call to
+	the Market Maker.
+
+	* query-params:
+		+ account:
+			- type: string
+			- description: account name or account id
+			- required: True
+
+	* path-params:
+		+ event_id:
+			- type: string
+			- description: event id
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			[
+			    {
+			        "expiration": "2018-07-26T05:11:48",
+			        "extensions": [],
+			        "operations": [
+			            [
+			                68,
+			                {
+			                    "bet_to_cancel": "1.22.1166",
+			                    "bettor_id": "1.2.104",
+			                    "extensions": [],
+			                    "fee": {
+			                        "amount": 0,
+			                        "asset_id": "1.3.0"
+			                    }
+			                }
+			            ]
+			        ],
+			        "ref_block_num": 20203,
+			        "ref_block_prefix": 1203983718,
+			        "signatures": [
+			            "1f616b8f816ba2abb31ba17d57a02be50a86b58ebc6e44ebe9b0d1ce881c3c54db09a9fa18142ef6ff5faacddf6b2767b59390acb9907dd366ca67788d96d91881"
+			        ]
+			    }
+			]
+
+	"""
+	try:
+		account = request.args.get("account")
+		if account is None:
+			return make_response(jsonify(error="Specify account in query params"), 500)
+		unmatched = fanout.submit(upstreamJson, '/bettors/%s/unmatchedBets' % quote(account))
+		groups = upstreamJson('/events/%s/bettingMarketGroups' % quote(event_id), 'bettingMarketGroups')
+		markets = set()
+		listings = fanout.map(lambda group: upstreamJson('/bettingMarketGroups/%s/bettingMarkets' % quote(group['id']), 'bettingMarkets'), groups)
+		for listing in listings:
+			markets.update(market['id'] for market in listing)
+		return cancelBetsInMarkets(account, markets, unmatched.result())
+	except upstream.UpstreamError as e:
+		return e.response()
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
 
 @app.route("/bettors/<bettor_id>/matchedBets", methods=['GET'])
 def getMatchedBets(bettor_id):
@@ -296,8 +669,7 @@ def getMatchedBets(bettor_id):
 			]	
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/bettors/<bettor_id>/unmatchedBets", methods=['GET'])
 def getUnmatchedBets(bettor_id):
@@ -339,8 +711,7 @@ def getUnmatchedBets(bettor_id):
 			]	
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/sports/<sport_id>", methods=['GET'])
 def getSport(sport_id):
@@ -374,8 +745,7 @@ def getSport(sport_id):
 		    }	
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/sports", methods=['GET'])
 def getSports():
@@ -424,8 +794,7 @@ def getSports():
 			]	
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/eventGroups/<event_group_id>", methods=['GET'])
 def getEventGroup(event_group_id):
@@ -461,8 +830,7 @@ def getEventGroup(event_group_id):
 		    }
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/sports/<sport_id>/eventGroups", methods=['GET'])
 def getEventGroups(sport_id):
@@ -518,8 +886,7 @@ def getEventGroups(sport_id):
 			]
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/events/<event_id>", methods=['GET'])
 def getEvent(event_id):
@@ -556,8 +923,7 @@ def getEvent(event_id):
 		    }
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/eventGroups/<event_group_id>/events", methods=['GET'])
 def getEvents(event_group_id):
@@ -615,8 +981,7 @@ def getEvents(event_group_id):
 			]
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/bettingMarketGroups/<bmg_id>", methods=['GET'])
 def getBettingMarketGroup(bmg_id):
@@ -659,8 +1024,7 @@ def getBettingMarketGroup(bmg_id):
 		    }
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/events/<event_id>/bettingMarketGroups", methods=['GET'])
 def getBettingMarketGroups(event_id):
@@ -730,8 +1094,7 @@ def getBettingMarketGroups(event_id):
 			]
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/bettingMarket", methods=['GET'])
 def getBettingMarketByQuery():
@@ -779,8 +1142,7 @@ def getBettingMarketByQuery():
 		    }
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/bettingMarkets/<betting_market_id>", methods=['GET'])
 def getBettingMarket(betting_market_id):
@@ -811,8 +1173,59 @@ def getBettingMarket(betting_market_id):
 		    }
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
+
+@app.route("/bettingMarkets/<betting_market_id>/orderBook", methods=['GET'])
+def getOrderBook(betting_market_id):
+	"""
+	**GET** ``/bettingMarkets/<betting_market_id>/orderBook``
+
+	Back and lay liquidity of the market grouped by odds level
+	(``backer_multiplier``) in ascending order, with amounts in the smallest
+	unit of the market's asset. The first read of a market fetches its book from the
+	chain; from then on a background thread refreshes it every
+	``order_book.refresh_interval`` seconds until it has not been read for
+	``order_book.watch_for`` seconds, and reads are answered from memory.
+	A bet placed through this API refreshes its market early, at most every
+	``order_book.touch_interval`` seconds.
+	``updated`` is when the book was last confirmed against the chain.
+
+	* path-params:
+		+ betting_market_id:
+			- type: string
+			- description: betting market id
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			{
+			    "back": [
+			        {
+			            "amount": 20000000,
+			            "backer_multiplier": 17000
+			        },
+			        {
+			            "amount": 5000000,
+			            "backer_multiplier": 18000
+			        }
+			    ],
+			    "betting_market_id": "1.21.3134",
+			    "lay": [
+			        {
+			            "amount": 13600000,
+			            "backer_multiplier": 16000
+			        }
+			    ],
+			    "updated": "2018-07-05T04:15:16.204"
+			}
+
+	"""
+	try:
+		book, updated = order_books.get(betting_market_id)
+		return jsonify(dict(book, updated=datetime.utcfromtimestamp(updated).isoformat(timespec='milliseconds')))
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
 
 @app.route("/bettingMarketGroups/<bmg_id>/bettingMarkets", methods=['GET'])
 def getBettingMarkets(bmg_id):
@@ -871,8 +1284,7 @@ def getBettingMarkets(bmg_id):
 			]
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 @app.route("/rules/<rules_id>", methods=['GET'])
 def getRules(rules_id):
@@ -912,8 +1324,7 @@ def getRules(rules_id):
 			}
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
 
 # MINT Calls
 
@@ -1998,10 +2409,33 @@ def getProposals():
 	"""
 	**GET** ``/proposals``
 
+	Served from an in-memory index of open proposals, refreshed after
+	``proposals.refresh_interval`` seconds or after any broadcast from this
+	process. Results are ordered by proposal id and paged; when more remain
+	the ``X-Next-Cursor`` response header holds the cursor of the next page.
+
 	* query-params:
 		+ account:
 			- type: string
 			- description: account name or id
+		+ op:
+			- type: integer
+			- description: only proposals containing this operation type, e.g. 63 for betting_market_group_resolve
+		+ object_id:
+			- type: string
+			- description: only proposals whose operations reference this object, e.g. 1.20.2109
+		+ proposer:
+			- type: string
+			- description: only proposals made by this account id
+		+ expiring_before:
+			- type: string
+			- description: only proposals expiring before this time, e.g. 2018-08-15T00:00:00
+		+ cursor:
+			- type: string
+			- description: X-Next-Cursor of the previous page
+		+ limit:
+			- type: integer
+			- description: page size, at most proposals.max_limit
 
 	* returns:
 		+ 200:
@@ -2112,7 +2546,121 @@ def getProposals():
 	"""
 	try:
 		account = request.args.get("account")
-		return jsonify(mint.getProposals(account))
+		expiring_before = request.args.get("expiring_before")
+		if expiring_before is not None:
+			expiring_before = datetime.strptime(expiring_before,'%Y-%m-%dT%H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S')
+		page, next_cursor = proposal_store.query(
+			account,
+			op=request.args.get("op", type=int),
+			object_id=request.args.get("object_id"),
+			proposer=request.args.get("proposer"),
+			expiring_before=expiring_before,
+			cursor=request.args.get("cursor"),
+			limit=request.args.get("limit", type=int))
+		response = jsonify(page)
+		if next_cursor is not None:
+			response.headers['X-Next-Cursor'] = next_cursor
+		return response
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
+
+@app.route("/proposals", methods=['PUT'])
+def approveProposals():
+	"""
+	**PUT** ``/proposals``
+
+	Approves or rejects many proposals at once, packing up to
+	``mint.batch_max_ops`` proposal updates into each transaction. Give either
+	a list of ``ids`` or a ``filter`` taking the same fields as the query
+	params of **GET** ``/proposals``.
+
+	* query-params:
+		+ approve:
+			- type: Boolean
+			- description: approve or disapprove the proposals
+		+ account:
+			- type: string
+			- description: account name or id whose open proposals a filter selects from
+
+	* body:
+	.. code-block:: json
+
+		{
+			"ids": ["1.10.2020", "1.10.2022"]
+		}
+
+	.. code-block:: json
+
+		{
+			"filter": {"op": 63, "expiring_before": "2018-08-15T00:00:00"}
+		}
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			{
+			    "results": [
+			        {
+			            "id": "1.10.2020",
+			            "transaction": 0
+			        },
+			        {
+			            "error": "NodeException: ProposalDoesNotExistException: 1.10.2022",
+			            "id": "1.10.2022"
+			        }
+			    ],
+			    "transactions": [
+			        {
+			            "expiration": "2018-08-14T03:02:53",
+			            "extensions": [],
+			            "operations": [],
+			            "ref_block_num": 24195,
+			            "ref_block_prefix": 1095264235,
+			            "signatures": []
+			        }
+			    ]
+			}
+	"""
+	try:
+		approve = request.args.get("approve")
+		account = request.args.get("account")
+		if approve is None:
+			return make_response(jsonify(error="Specify approve in query params"), 500)
+		body = request.get_json()
+		if 'ids' in body:
+			proposal_ids = body['ids']
+		elif 'filter' in body:
+			where = body['filter']
+			op = where.get('op')
+			if op is not None:
+				try:
+					op = int(op)
+				except (TypeError, ValueError):
+					return make_response(jsonify(error="filter op must be an operation type number"), 500)
+			expiring_before = where.get('expiring_before')
+			if expiring_before is not None:
+				expiring_before = datetime.strptime(expiring_before,'%Y-%m-%dT%H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S')
+			proposal_ids = []
+			cursor = None
+			while True:
+				page, cursor = proposal_store.query(
+					account,
+					op=op,
+					object_id=where.get('object_id'),
+					proposer=where.get('proposer'),
+					expiring_before=expiring_before,
+					cursor=cursor)
+				proposal_ids.extend(proposal['id'] for proposal in page)
+				if cursor is None:
+					break
+		else:
+			return make_response(jsonify(error="Specify ids or filter in body"), 500)
+		approve = approve.lower() in ('true', '1', 'yes')
+		transactions, results = mint.approveProposals(proposal_ids, approve, mint_config.get('batch_max_ops', 50))
+		if transactions:
+			response_cache.invalidate()
+		return jsonify(transactions=transactions, results=results)
 	except Exception as e:
 		return make_response(jsonify(error=str(e)), 500)
 
@@ -2174,7 +2722,242 @@ def approveProposal(proposal_id):
 		account = request.args.get("account")
 		if approve is None:
 			return make_response(jsonify(error="Specify approve in query params"), 500)
-		return jsonify(mint.approveProposal(proposal_id, approve))
+		result = mint.approveProposal(proposal_id, approve)
+		response_cache.invalidate()
+		return jsonify(result)
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
+
+# operations accepted by /mint/batch: the Node method and how its arguments
+# are read from the same body as the single-operation route
+MINT_OPERATIONS = {
+	'createSport': lambda body: (body['name'],),
+	'updateSport': lambda body: (body['sport_id'], body['name']),
+	'createEventGroup': lambda body: (body['name'], body['sport_id']),
+	'updateEventGroup': lambda body: (body['event_group_id'], body['name'], body['sport_id']),
+	'createEvent': lambda body: (body['name'], body['season'], datetime.strptime(body['start_time'],'%Y-%m-%dT%H:%M:%S'), body['event_group_id']),
+	'updateEvent': lambda body: (body['event_id'], body['name'], body['season'], datetime.strptime(body['start_time'],'%Y-%m-%dT%H:%M:%S'), body['event_group_id'], body['status']),
+	'updateEventStatus': lambda body: (body['event_id'], body['status'], body['scores']),
+	'createBettingMarketGroup': lambda body: (body['description'], body['event_id'], body['betting_market_rule_id'], body['asset']),
+	'updateBettingMarketGroup': lambda body: (body['betting_market_group_id'], body['description'], body['event_id'], body['betting_market_rule_id'], body['status']),
+	'updateBettingMarketGroupRule': lambda body: (body['betting_market_rule_id'], body['name'], body['description']),
+	'createBettingMarket': lambda body: (body['payout_condition'], body['description'], body['betting_market_group_id']),
+	'updateBettingMarket': lambda body: (body['betting_market_id'], body['payout_condition'], body['description'], body['betting_market_group_id']),
+	'resolveBettingMarketGroup': lambda body: (body['betting_market_group_id'], body['result_list'])
+}
+
+@app.route("/mint/batch", methods=['POST'])
+def mintBatch():
+	"""
+	**POST** ``/mint/batch``
+
+	Queues every operation on one Node and broadcasts them together, split
+	over several transactions only when ``mint.batch_max_ops`` or
+	``mint.batch_max_bytes`` would be exceeded. Each ``body`` is the body of
+	the matching single-operation route; ``resolveBettingMarketGroup`` also
+	takes ``betting_market_group_id`` in its body. Relative ids (``0.0.x``)
+	are not supported here, as an operation may land in another transaction.
+
+	* body:
+	.. code-block:: json
+
+		[
+			{
+				"op": "createBettingMarketGroup",
+				"body": {
+					"description": [["en", "Moneyline"]],
+					"event_id": "1.18.2240",
+					"betting_market_rule_id": "1.19.5",
+					"asset": "BTF"
+				}
+			},
+			{
+				"op": "updateEventStatus",
+				"body": {
+					"event_id": "1.18.2241",
+					"status": "in_progress",
+					"scores": []
+				}
+			}
+		]
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			{
+			    "results": [
+			        {
+			            "op": "createBettingMarketGroup",
+			            "transaction": 0
+			        },
+			        {
+			            "error": "NodeException: Event (id=1.18.2241) could not be loaded",
+			            "op": "updateEventStatus"
+			        }
+			    ],
+			    "transactions": [
+			        {
+			            "expiration": "2018-08-14T04:15:41",
+			            "extensions": [],
+			            "operations": [],
+			            "ref_block_num": 25609,
+			            "ref_block_prefix": 2528423905,
+			            "signatures": []
+			        }
+			    ]
+			}
+
+	"""
+	try:
+		body = request.get_json()
+		operations = []
+		positions = []
+		results = []
+		for entry in body:
+			name = entry.get('op')
+			results.append({"op": name})
+			if name not in MINT_OPERATIONS:
+				results[-1]["error"] = "unknown op"
+				continue
+			try:
+				operations.append((name, MINT_OPERATIONS[name](entry.get('body') or {})))
+				positions.append(len(results) - 1)
+			except KeyError as e:
+				results[-1]["error"] = "missing field " + str(e)
+			except Exception as e:
+				results[-1]["error"] = str(e)
+		transactions, outcomes = mint.batch(operations, mint_config.get('batch_max_ops', 50), mint_config.get('batch_max_bytes', 16384))
+		for position, outcome in zip(positions, outcomes):
+			results[position].update(outcome)
+		return jsonify(transactions=transactions, results=results)
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
+
+# levels of a /mint/tree body: key, child list key, Node create method and
+# how its arguments are read given the parent id
+MINT_TREE_LEVELS = [
+	('sport', 'event_groups', 'createSport', lambda node, parent: (node['name'],)),
+	('event_group', 'events', 'createEventGroup', lambda node, parent: (node['name'], parent)),
+	('event', 'betting_market_groups', 'createEvent', lambda node, parent: (node['name'], node['season'], datetime.strptime(node['start_time'],'%Y-%m-%dT%H:%M:%S'), parent)),
+	('betting_market_group', 'betting_markets', 'createBettingMarketGroup', lambda node, parent: (node['description'], parent, node['betting_market_rule_id'], node['asset'])),
+	('betting_market', None, 'createBettingMarket', lambda node, parent: (node['payout_condition'], node['description'], parent))
+]
+
+# the parent id a tree rooted at each level takes from the body
+MINT_TREE_PARENTS = {
+	'event_group': 'sport_id',
+	'event': 'event_group_id',
+	'betting_market_group': 'event_id'
+}
+
+def treeOperations(body):
+	"""
+	Flatten a /mint/tree body into create operations in parent-first order.
+	Objects created in the tree are referred to by their relative id
+	``0.0.<position>``; a node with an ``id`` is an existing object and only
+	parents its children. Returns the operations and, per created object, its
+	path in the tree and relative id.
+	"""
+	levels = [level[0] for level in MINT_TREE_LEVELS]
+	roots = [key for key in levels if key in body]
+	if len(roots) != 1 or roots[0] == 'betting_market':
+		raise ValueError("body needs exactly one of sport, event_group, event, betting_market_group")
+	root = roots[0]
+	operations = []
+	objects = []
+
+	def visit(depth, node, parent, path):
+		key, children, method, parse = MINT_TREE_LEVELS[depth]
+		if 'id' in node:
+			object_id = node['id']
+		else:
+			object_id = '0.0.%d' % len(operations)
+			operations.append((method, parse(node, parent)))
+			objects.append({"path": path, "id": object_id})
+		if children is not None:
+			for index, child in enumerate(node.get(children) or []):
+				visit(depth + 1, child, object_id, '%s.%s[%d]' % (path, children, index))
+
+	visit(levels.index(root), body[root], body.get(MINT_TREE_PARENTS.get(root)), root)
+	return operations, objects
+
+@app.route("/mint/tree", methods=['POST'])
+def mintTree():
+	"""
+	**POST** ``/mint/tree``
+
+	Creates a whole market tree in one proposal and one broadcast. The body
+	holds exactly one root (``sport``, ``event_group``, ``event`` or
+	``betting_market_group``); a root below sport names its existing parent
+	(``sport_id``, ``event_group_id`` or ``event_id``). Any node given an
+	``id`` is an existing object that is not created again. Created objects
+	are returned with the relative id (``0.0.x``) they carry in the proposal.
+
+	* body:
+	.. code-block:: json
+
+		{
+			"event_group_id": "1.17.17",
+			"event": {
+				"name": [["en", "Michael Event"]],
+				"season": [["en", "2018"]],
+				"start_time": "2018-08-17T21:08:47",
+				"betting_market_groups": [{
+					"description": [["en", "Moneyline"]],
+					"betting_market_rule_id": "1.19.5",
+					"asset": "BTF",
+					"betting_markets": [
+						{"payout_condition": [["en", "Home"]], "description": [["en", "Home"]]},
+						{"payout_condition": [["en", "Away"]], "description": [["en", "Away"]]}
+					]
+				}]
+			}
+		}
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			{
+			    "objects": [
+			        {
+			            "id": "0.0.0",
+			            "path": "event"
+			        },
+			        {
+			            "id": "0.0.1",
+			            "path": "event.betting_market_groups[0]"
+			        },
+			        {
+			            "id": "0.0.2",
+			            "path": "event.betting_market_groups[0].betting_markets[0]"
+			        },
+			        {
+			            "id": "0.0.3",
+			            "path": "event.betting_market_groups[0].betting_markets[1]"
+			        }
+			    ],
+			    "transaction": {
+			        "expiration": "2018-08-14T04:15:41",
+			        "extensions": [],
+			        "operations": [],
+			        "ref_block_num": 25609,
+			        "ref_block_prefix": 2528423905,
+			        "signatures": []
+			    }
+			}
+
+	"""
+	try:
+		body = request.get_json()
+		operations, objects = treeOperations(body)
+		if not operations:
+			return make_response(jsonify(error="nothing to create"), 500)
+		result = mint.propose(operations)
+		return jsonify(transaction=result, objects=objects)
+	except KeyError as e:
+		return make_response(jsonify(error="missing field " + str(e)), 500)
 	except Exception as e:
 		return make_response(jsonify(error=str(e)), 500)
 
@@ -2185,11 +2968,32 @@ def getHistory(bettor_id):
 	"""
 	**GET** ``/bettors/<bettor_id>/history``
 
+	With ``history.enabled`` the history is served from a local append-only
+	copy that only asks the chain for operations newer than the last one
+	held. ``since``, ``since_block`` or ``limit`` then page it oldest first,
+	the next page's ``since`` being given in the ``X-Next-Cursor`` header.
+	Otherwise it is passed through to the Market Maker, streamed and under
+	the ``history`` bulkhead.
+
 	* path-params:
 		+ bettor_id:
 			- type: string
 			- description: account name or id
 
+	* query-params:
+		+ since:
+			- type: string
+			- description: only operations after this operation id, e.g. ``1.11.13588``
+		+ since_block:
+			- type: int
+			- description: only operations after this block number
+		+ limit:
+			- type: int
+			- description: maximum number of operations to return
+		+ fields:
+			- type: string
+			- description: comma separated (dotted) fields to keep in each operation, e.g. ``id,block_num,op``
+
 	* returns:
 		+ 200:
 		.. code-block:: json
@@ -2232,8 +3036,23 @@ def getHistory(bettor_id):
 			]	
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	if bettor_history is None:
+		return proxy()
+	try:
+		page, next_cursor = bettor_history.query(
+			bettor_id,
+			since=request.args.get("since"),
+			since_block=request.args.get("since_block", type=int),
+			limit=request.args.get("limit", type=int))
+		fields = upstream.splitFields(request.query_string.decode('utf-8'))[1]
+		if fields:
+			page = upstream.project(page, fields)
+		response = jsonify(page)
+		if next_cursor is not None:
+			response.headers['X-Next-Cursor'] = next_cursor
+		return response
+	except Exception as e:
+		return make_response(jsonify(error=str(e)), 500)
 
 @app.route("/bettors/<bettor_id>/accountDetails", methods=['GET'])
 def getAccountDetails(bettor_id):
@@ -2244,6 +3063,10 @@ def getAccountDetails(bettor_id):
 		+ bettor_id:
 			- type: string
 			- description: account name or id
+	* query-params:
+		+ fields:
+			- type: string
+			- description: comma separated (dotted) fields to return, e.g. ``balances`` or ``id,options.votes``
 	* returns:
 		+ 200:
 		.. code-block:: json
@@ -2335,14 +3158,234 @@ def getAccountDetails(bettor_id):
 			}
 
 	"""
-	response = requests.get(market_maker_url + request.full_path)
-	return (response.content, response.status_code, response.headers.items())
+	return proxy()
+
+@app.route("/stats", methods=['GET'])
+def getStats():
+	"""
+	**GET** ``/stats``
+
+	* returns:
+		+ 200:
+		.. code-block:: json
+
+			{
+			    "cache": {
+			        "entries": 212,
+			        "evictions": 0,
+			        "hits": 5840,
+			        "invalidations": 37,
+			        "max_entries": 1024,
+			        "misses": 249
+			    },
+			    "compression": {
+			        "bytes_in": 48211090,
+			        "bytes_out": 3190214,
+			        "encodings": [
+			            "gzip",
+			            "deflate"
+			        ],
+			        "responses": {
+			            "gzip": 1288
+			        }
+			    },
+			    "history": {
+			        "accounts": 12,
+			        "fetched": 3921,
+			        "operations": 3921,
+			        "polls": 2210
+			    },
+			    "mint": {
+			        "calls": {
+			            "createEvent": {
+			                "avg_ms": 412.5,
+			                "calls": 40,
+			                "errors": 0,
+			                "max_ms": 903.1,
+			                "total_ms": 16500.0
+			            }
+			        },
+			        "connected": true,
+			        "node": "wss://witness-2.example.com/ws",
+			        "witnesses": {
+			            "nodes": [
+			                {
+			                    "error": "head block 184 s old",
+			                    "failures": 0,
+			                    "head_age_s": 184.2,
+			                    "healthy": false,
+			                    "latency_ms": 35.1,
+			                    "url": "wss://witness-1.example.com/ws"
+			                },
+			                {
+			                    "error": null,
+			                    "failures": 0,
+			                    "head_age_s": 1.3,
+			                    "healthy": true,
+			                    "latency_ms": 62.8,
+			                    "url": "wss://witness-2.example.com/ws"
+			                }
+			            ],
+			            "rounds": 41,
+			            "switches": 1
+			        }
+			    },
+			    "order_books": {
+			        "changes": 311,
+			        "errors": 0,
+			        "refreshes": 9204,
+			        "watched": 6
+			    },
+			    "proposals": {
+			        "accounts": 1,
+			        "proposals": 318,
+			        "refreshes": 42
+			    },
+			    "upstream": {
+			        "async_coalescing": null,
+			        "backends": [
+			            {
+			                "calls": 5120,
+			                "consecutive_failures": 0,
+			                "in_flight": 3,
+			                "latency_ms": 41.7,
+			                "opened": 0,
+			                "state": "closed",
+			                "url": "http://10.0.0.11:8010"
+			            },
+			            {
+			                "calls": 2964,
+			                "consecutive_failures": 0,
+			                "in_flight": 1,
+			                "latency_ms": 88.2,
+			                "opened": 1,
+			                "state": "closed",
+			                "url": "http://10.0.0.12:8010"
+			            }
+			        ],
+			        "bulkheads": {
+			            "history": {
+			                "in_flight": 1,
+			                "limit": 4,
+			                "rejected": 0
+			            }
+			        },
+			        "coalescing": {
+			            "coalesced": 8731,
+			            "in_flight": 2,
+			            "upstream_calls": 1500
+			        },
+			        "hedging": {
+			            "eligible": 6210,
+			            "enabled": true,
+			            "hedged": 304,
+			            "won": 211
+			        },
+			        "pool": {
+			            "hits": 1487,
+			            "hosts": 1,
+			            "misses": 13,
+			            "pool_connections": 4,
+			            "pool_maxsize": 32,
+			            "requests": 1500
+			        }
+			    }
+			}
+
+	"""
+	return jsonify(upstream={"pool": market_maker.poolStats(), "coalescing": in_flight.stats(), "async_coalescing": async_in_flight.stats() if async_in_flight is not None else None, "backends": market_maker.backendStats(), "bulkheads": market_maker.bulkheads.stats(), "hedging": market_maker.hedgeStats()}, cache=response_cache.stats(), mint=mint.stats(), proposals=proposal_store.stats(), order_books=order_books.stats(), compression=compressor.stats(), history=bettor_history.stats() if bettor_history is not None else None)
+
+@app.route("/metrics", methods=['GET'])
+def getMetrics():
+	"""
+	**GET** ``/metrics``
+
+	Request counts, error counts and latency histograms per route, with the
+	Market Maker and bos_mint Node (call and broadcast) times as separate
+	series, in the Prometheus text format.
+
+	* returns:
+		+ 200:
+		.. code-block:: text
+
+			# HELP qaapi_request_duration_seconds Time to produce a response, by route.
+			# TYPE qaapi_request_duration_seconds histogram
+			qaapi_request_duration_seconds_bucket{route="getEvents",le="0.001"} 912
+			qaapi_request_duration_seconds_bucket{route="getEvents",le="0.0025"} 1377
+			...
+			qaapi_request_duration_seconds_bucket{route="getEvents",le="+Inf"} 1500
+			qaapi_request_duration_seconds_sum{route="getEvents"} 3.0127
+			qaapi_request_duration_seconds_count{route="getEvents"} 1500
+
+	"""
+	return Response(metrics.REGISTRY.render(), 200, {'Content-Type': metrics.CONTENT_TYPE})
+
+def loadConfig(config_path=None):
+	"""
+	Parse config.yaml from ``config_path``, else ``$QAAPI_CONFIG``, else the
+	working directory.
+	"""
+	config_path = config_path or os.environ.get('QAAPI_CONFIG', 'config.yaml')
+	with open(config_path, 'r') as stream:
+		config = yaml.safe_load(stream)
+	config['config_dir'] = os.path.dirname(os.path.abspath(config_path))
+	return config
+
+def configure(config):
+	"""
+	Build the state the routes share, once per worker process.
+	"""
+	global market_maker, response_cache, in_flight, async_in_flight, fanout, mint_config, proposal_store, order_book_config, order_books, compressor, history_config, bettor_history, server_timing, proxy_only
+	market_maker = upstream.MarketMaker(config['market-maker'])
+	response_cache = cache.TTLCache(config.get('cache') or {})
+	in_flight = upstream.SingleFlight()
+	async_in_flight = None
+	fanout = ThreadPoolExecutor(max_workers=config['market-maker'].get('fanout_workers', 8))
+	server = config.get('server') or {}
+	proxy_only = server.get('proxy_only', False)
+	mint_config = config.get('mint') or {}
+	bos_mint_config = os.path.join(config.get('config_dir', '.'), mint_config.get('bos_mint_config', 'config-bos-mint.yaml'))
+	if mint_config.get('simulate') and not proxy_only:
+		import chainsim
+		with open(bos_mint_config, 'r') as bos_mint_stream:
+			chain = chainsim.ChainSimulator(yaml.safe_load(bos_mint_stream), mint_config)
+		mint.useNode(chainsim.SimulatedNode(chain))
+	else:
+		mint.useBosMintConfig(bos_mint_config)
+		if (mint_config.get('witness_nodes') or {}).get('enabled') and not proxy_only:
+			mint.useWitnesses(witnesses.WitnessNodes(bos_mint_config, mint_config['witness_nodes']))
+	proposal_store = proposals.ProposalStore(mint.getProposals, mint.broadcastCount, config.get('proposals') or {})
+	order_book_config = config.get('order_book') or {}
+	order_books = orderbook.OrderBooks(lambda betting_market_id: mint.getBinnedOrderBook(betting_market_id, order_book_config.get('precision', 0)), order_book_config)
+	compressor = compression.Compressor(config.get('compression') or {})
+	history_config = config.get('history') or {}
+	bettor_history = None
+	if history_config.get('enabled') and not proxy_only:
+		bettor_history = history.BettorHistory(mint.getAccountHistory, mint.getAccountId, history_config)
+	server_timing = server.get('server_timing', True)
+
+def create_app(config=None):
+	"""
+	App factory for WSGI servers: ``wsgi.py`` calls it once per worker,
+	loading config.yaml as ``loadConfig`` does unless a parsed ``config`` is
+	given.
+	"""
+	configure(config if config is not None else loadConfig())
+	return app
 
 if __name__ == '__main__':
-	with open("config.yaml", 'r') as stream:
-		try:
-			config = yaml.safe_load(stream)
-			market_maker_url = config['market-maker']['url']
-		except yaml.YAMLError as exc:
-			print(exc)
-		app.run(debug=False, host='0.0.0.0', port=5050)
+	config = loadConfig()
+	create_app(config)
+	server = config.get('server') or {}
+	host = server.get('host', '0.0.0.0')
+	port = server.get('port', 5050)
+	if server.get('engine') == 'asyncio':
+		import aioserve
+		# the history cache lives in this process, so its route is not proxied
+		proxy_endpoints = PROXY_ENDPOINTS if bettor_history is None else PROXY_ENDPOINTS - set(['getHistory'])
+		engine = aioserve.AsyncProxy(app, server.get('asyncio') or {}, market_maker, response_cache, proxy_endpoints, CACHED_ENDPOINTS, compressor, server_timing)
+		# Flask routes keep the threaded in_flight; the event loop coalesces its own proxied GETs
+		async_in_flight = engine.in_flight
+		aioserve.run(engine, host, port)
+	else:
+		app.run(debug=False, host=host, port=port)
@@ -0,0 +1,735 @@
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from urllib.parse import unquote_plus
+from werkzeug.http import generate_etag
+from werkzeug.http import parse_etags
+from werkzeug.http import quote_etag
+from werkzeug.http import unquote_etag
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Market Maker client
+# One pooled, keep-alive session per worker process, shared by every proxy route
+# and spread over the configured Market Maker replicas.
+
+# RFC 7230 section 6.1, never forwarded by a proxy
+HOP_BY_HOP_HEADERS = frozenset([
+	'connection',
+	'keep-alive',
+	'proxy-authenticate',
+	'proxy-authorization',
+	'proxy-connection',
+	'te',
+	'trailer',
+	'trailers',
+	'transfer-encoding',
+	'upgrade'
+])
+
+# safe to send to another replica, and never counted as bets
+READ_METHODS = frozenset(['GET', 'HEAD'])
+
+# set again by the server answering the client; relaying them would send two,
+# and a cached response would keep its first Date
+ORIGIN_HEADERS = frozenset([
+	'date',
+	'server'
+])
+
+def forwardHeaders(response, encoded=False):
+	"""
+	Headers of an upstream response that are safe to relay to the client.
+	Hop-by-hop headers, any named in ``Connection``, and the Market Maker's own
+	``Date`` and ``Server`` are dropped. Unless the
+	body is relayed still ``encoded``, Content-Encoding and Content-Length
+	describe bytes requests has already decoded and are dropped too.
+	"""
+	drop = set(HOP_BY_HOP_HEADERS | ORIGIN_HEADERS)
+	for name in response.headers.get('Connection', '').split(','):
+		drop.add(name.strip().lower())
+	if not encoded:
+		drop.add('content-encoding')
+		drop.add('content-length')
+	return [(name, value) for name, value in response.headers.items() if name.lower() not in drop]
+
+def iterBody(response, chunk_size, release=None):
+	"""
+	Yield the raw upstream body as it arrives, without decoding it. The
+	connection goes back to the pool once the body is fully read, and is
+	closed if the client goes away first; either way ``release`` then gives
+	back the bulkhead slot of the call.
+	"""
+	finished = False
+	try:
+		for chunk in response.raw.stream(chunk_size, decode_content=False):
+			yield chunk
+		finished = True
+	finally:
+		if finished:
+			response.raw.release_conn()
+		else:
+			response.close()
+		if release is not None:
+			release()
+
+def resourceOf(path):
+	"""
+	First segment of a Market Maker path (``/bettors``), a label of bounded
+	cardinality for its metrics.
+	"""
+	return '/' + path.split('?', 1)[0].lstrip('/').split('/', 1)[0]
+
+def splitFields(query_string):
+	"""
+	Take the ``fields`` parameter out of a raw query string. Returns the rest
+	of the query string, byte for byte, and the requested field paths, or
+	None when the parameter is absent.
+	"""
+	kept = []
+	fields = None
+	for part in query_string.split('&'):
+		name, _, value = part.partition('=')
+		if unquote_plus(name) == 'fields':
+			fields = (fields or []) + [field.strip() for field in unquote_plus(value).split(',') if field.strip()]
+		elif part:
+			kept.append(part)
+	return '&'.join(kept), fields
+
+def project(value, fields):
+	"""
+	Keep only the dotted field paths ``fields`` (``balances``,
+	``options.votes``) of a JSON document. Lists are projected item by item.
+	"""
+	tree = {}
+	for field in fields:
+		node = tree
+		for key in field.split('.'):
+			node = node.setdefault(key, {})
+
+	def select(value, tree):
+		if not tree:
+			return value
+		if isinstance(value, list):
+			return [select(item, tree) for item in value]
+		if isinstance(value, dict):
+			return dict((key, select(value[key], subtree)) for key, subtree in tree.items() if key in value)
+		return value
+
+	return select(value, tree)
+
+def projectResult(result, fields):
+	"""
+	Apply ``project`` to a buffered ``(content, status, headers)`` result.
+	Errors and bodies that are not JSON are returned unchanged.
+	"""
+	content, status, headers = result
+	if status != 200:
+		return result
+	started = time.perf_counter()
+	try:
+		document = json.loads(content)
+	except ValueError:
+		return result
+	content = json.dumps(project(document, fields), separators=(',', ':')).encode('utf-8')
+	metrics.addTiming('serialize', time.perf_counter() - started)
+	# the upstream ETag described the untrimmed body
+	headers = [(name, value) for name, value in headers if name.lower() not in ('content-type', 'etag')]
+	headers.append(('Content-Type', 'application/json'))
+	return (content, status, headers)
+
+def etagOf(headers):
+	for name, value in headers:
+		if name.lower() == 'etag':
+			return value
+	return None
+
+def withEtag(result):
+	"""
+	Give a buffered result a weak ETag hashed from its body unless upstream
+	sent one. Weak, since the bytes differ once the body is compressed.
+	"""
+	content, status, headers = result
+	if etagOf(headers) is not None:
+		return result
+	return (content, status, list(headers) + [('ETag', quote_etag(generate_etag(content), weak=True))])
+
+def notModified(if_none_match, etag):
+	"""
+	Whether an ``If-None-Match`` header matches ``etag``, by the weak
+	comparison RFC 7232 prescribes for it.
+	"""
+	if not if_none_match or etag is None:
+		return False
+	return parse_etags(if_none_match).contains_weak(unquote_etag(etag)[0])
+
+class UpstreamError(Exception):
+	"""
+	A Market Maker response that was needed as data but was not a 200.
+	"""
+
+	def __init__(self, content, status, headers):
+		Exception.__init__(self, 'Market Maker returned %d' % status)
+		self.content = content
+		self.status = status
+		self.headers = headers
+
+	def response(self):
+		return (self.content, self.status, self.headers)
+
+class UpstreamFailure(UpstreamError):
+	"""
+	A Market Maker call that got no response: it timed out (504), could not
+	connect (503), or was refused without being sent because the circuit is
+	open or its route class is at its limit (503). Carries a JSON error
+	response to relay instead.
+	"""
+
+	def __init__(self, message, status=503, retry_after=None):
+		headers = [('Content-Type', 'application/json')]
+		if retry_after is not None:
+			headers.append(('Retry-After', str(int(math.ceil(retry_after)))))
+		UpstreamError.__init__(self, json.dumps({"error": message}).encode('utf-8'), status, headers)
+		self.args = (message,)
+
+def routeClass(method, path):
+	"""
+	Bulkhead a Market Maker call counts against: ``bets`` for placing and
+	cancelling bets, ``history`` for bettor history, ``reads`` for every
+	other read (GET or HEAD).
+	"""
+	if method not in READ_METHODS:
+		return 'bets'
+	if path.split('?', 1)[0].endswith('/history'):
+		return 'history'
+	return 'reads'
+
+class CircuitBreaker(object):
+	"""
+	Tracks whether one Market Maker replica is healthy. After
+	``failure_threshold`` consecutive failures (timeouts, connection errors,
+	``failure_statuses`` responses, failed health checks) the circuit opens and the replica
+	gets no calls for ``reset_timeout`` seconds. Then one trial call is let
+	through: the circuit closes if it succeeds and opens again if it fails.
+	A threshold of 0 turns the breaker off.
+	"""
+
+	def __init__(self, config):
+		self.failure_threshold = config.get('failure_threshold', 5)
+		self.reset_timeout = config.get('reset_timeout', 10.0)
+		# a 500 is how the Market Maker reports a bad request, not a sick replica
+		self.failure_statuses = frozenset(config.get('failure_statuses', (502, 503, 504)))
+		self.lock = threading.Lock()
+		self.state = 'closed'
+		self.failures = 0
+		self.opened_at = 0.0
+		self.trial_at = None
+		self.opened = 0
+
+	def available(self, now):
+		"""
+		Whether ``allow`` would let a call through at ``now``.
+		"""
+		if self.state == 'closed':
+			return True
+		if self.state == 'open':
+			return now - self.opened_at >= self.reset_timeout
+		# a trial whose outcome was never recorded does not block the next one
+		return self.trial_at is None or now - self.trial_at >= self.reset_timeout
+
+	def allow(self):
+		"""
+		Whether a call may be sent now. Takes the trial call of a circuit that
+		has been open for ``reset_timeout``.
+		"""
+		with self.lock:
+			now = time.monotonic()
+			if not self.available(now):
+				return False
+			if self.state == 'open':
+				self.state = 'half_open'
+			if self.state == 'half_open':
+				self.trial_at = now
+			return True
+
+	def healthy(self, status):
+		"""
+		Whether a response with ``status`` counts as a success.
+		"""
+		return status not in self.failure_statuses
+
+	def retryAfter(self):
+		with self.lock:
+			return max(self.reset_timeout - (time.monotonic() - self.opened_at), 1.0)
+
+	def record(self, succeeded):
+		if not self.failure_threshold:
+			return
+		with self.lock:
+			if succeeded:
+				self.failures = 0
+				self.state = 'closed'
+				return
+			self.failures += 1
+			if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+				self.state = 'open'
+				self.opened_at = time.monotonic()
+				self.opened += 1
+
+	def stats(self):
+		with self.lock:
+			return {
+				"state": self.state,
+				"consecutive_failures": self.failures,
+				"opened": self.opened
+			}
+
+class Backend(object):
+	"""
+	One Market Maker replica: its circuit breaker, the calls in flight to it
+	and a moving average of its response time.
+	"""
+
+	def __init__(self, url, breaker_config, decay):
+		self.url = url
+		self.breaker = CircuitBreaker(breaker_config)
+		self.decay = decay
+		self.lock = threading.Lock()
+		self.latency = None
+		self.in_flight = 0
+		self.calls = 0
+
+	def score(self):
+		"""
+		Expected wait for one more call: the average response time scaled by
+		the calls already in flight. A replica not yet heard from scores 0, so
+		it is tried first.
+		"""
+		return (self.latency or 0.0) * (self.in_flight + 1)
+
+	def started(self):
+		with self.lock:
+			self.in_flight += 1
+			self.calls += 1
+
+	def finished(self, elapsed, succeeded):
+		with self.lock:
+			self.in_flight -= 1
+		self.observe(elapsed, succeeded)
+
+	def observe(self, elapsed, succeeded):
+		"""
+		Account for a call or health check that got a response, or failed,
+		after ``elapsed`` seconds. A timeout counts too, so a replica that
+		stalls scores badly. ``succeeded`` is None for a call given up on,
+		such as the slower half of a hedged GET, which says nothing of health.
+		"""
+		with self.lock:
+			self.latency = elapsed if self.latency is None else self.latency + self.decay * (elapsed - self.latency)
+		if succeeded is not None:
+			self.breaker.record(succeeded)
+
+	def stats(self):
+		with self.lock:
+			stats = {
+				"url": self.url,
+				"latency_ms": self.latency * 1000 if self.latency is not None else None,
+				"in_flight": self.in_flight,
+				"calls": self.calls
+			}
+		stats.update(self.breaker.stats())
+		return stats
+
+class Bulkheads(object):
+	"""
+	Caps the Market Maker calls of each route class in flight at once, per
+	worker process, so a class that slows down fills its own slots rather
+	than every worker thread. A call waits up to ``wait`` seconds for a slot
+	and is then refused. Classes without a limit are not capped.
+	"""
+
+	def __init__(self, limits, wait):
+		self.limits = dict((name, limit) for name, limit in (limits or {}).items() if limit)
+		self.wait = wait
+		self.slots = dict((name, threading.BoundedSemaphore(limit)) for name, limit in self.limits.items())
+		self.lock = threading.Lock()
+		self.active = dict((name, 0) for name in self.limits)
+		self.rejected = dict((name, 0) for name in self.limits)
+
+	def acquire(self, route_class):
+		"""
+		Take a slot of ``route_class``, returning the function that gives it
+		back (calling it again does nothing), or raise UpstreamFailure.
+		"""
+		slots = self.slots.get(route_class)
+		if slots is None:
+			return lambda: None
+		if not slots.acquire(timeout=self.wait):
+			raise self.refuse(route_class)
+		self.count(route_class, 1)
+		held = [True]
+
+		def release():
+			with self.lock:
+				if not held:
+					return
+				held.pop()
+			self.count(route_class, -1)
+			slots.release()
+
+		return release
+
+	def count(self, route_class, change):
+		with self.lock:
+			self.active[route_class] += change
+
+	def refuse(self, route_class):
+		"""
+		The error for a call that found no free slot of ``route_class``.
+		"""
+		with self.lock:
+			self.rejected[route_class] += 1
+		metrics.UPSTREAM_REJECTED.inc('bulkhead', route_class)
+		return UpstreamFailure('Too many %s calls to the Market Maker in flight' % route_class, 503, 1)
+
+	def stats(self):
+		with self.lock:
+			return dict((name, {"limit": limit, "in_flight": self.active[name], "rejected": self.rejected[name]}) for name, limit in self.limits.items())
+
+class _Call(object):
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+class SingleFlight(object):
+	"""
+	Coalesces identical concurrent calls: the first caller for a key runs the
+	call, callers arriving while it is in flight wait and share its result.
+	"""
+
+	def __init__(self):
+		self.calls = {}
+		self.lock = threading.Lock()
+		self.leaders = 0
+		self.followers = 0
+
+	def do(self, key, fn):
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = _Call()
+				self.calls[key] = call
+				self.leaders += 1
+			else:
+				self.followers += 1
+		if not leader:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+		try:
+			call.result = fn()
+		except Exception as e:
+			call.error = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call.done.set()
+		return call.result
+
+	def stats(self):
+		with self.lock:
+			return {
+				"in_flight": len(self.calls),
+				"upstream_calls": self.leaders,
+				"coalesced": self.followers
+			}
+
+class MarketMaker(object):
+	"""
+	Client of one or more Market Maker replicas, ``url`` or the list
+	``urls``. Each call goes to the healthy replica with the best expected
+	wait, and idempotent GETs can be hedged to a second replica.
+	"""
+
+	def __init__(self, config):
+		urls = config.get('urls') or [config['url']]
+		self.pool_connections = config.get('pool_connections', 4)
+		self.pool_maxsize = config.get('pool_maxsize', 32)
+		self.stream_endpoints = frozenset(config.get('stream_endpoints') or [])
+		self.chunk_size = config.get('chunk_size', 65536)
+		self.coalesce = config.get('coalesce', True)
+		self.connect_timeout = config.get('connect_timeout', 3.05)
+		self.read_timeout = config.get('read_timeout', 30)
+		self.backends = [Backend(url, config.get('circuit_breaker') or {}, config.get('latency_decay', 0.3)) for url in urls]
+		self.bulkheads = Bulkheads(config.get('bulkheads'), config.get('bulkhead_wait', 0.5))
+		health_check = config.get('health_check') or {}
+		self.health_path = health_check.get('path', '/sports')
+		self.health_interval = health_check.get('interval', 5)
+		self.checker = None
+		hedge = config.get('hedge') or {}
+		self.hedge = hedge.get('enabled', False) and len(self.backends) > 1
+		self.hedge_percentile = hedge.get('percentile', 0.95)
+		self.hedge_min_delay = hedge.get('min_delay', 0.01)
+		self.hedge_ratio = hedge.get('max_ratio', 0.1)
+		self.hedge_samples = hedge.get('min_samples', 20)
+		self.hedge_executor = ThreadPoolExecutor(max_workers=hedge.get('workers', 16), thread_name_prefix='hedge') if self.hedge else None
+		self.lock = threading.Lock()
+		# recent response times of all replicas, for the hedge delay
+		self.latencies = deque(maxlen=hedge.get('window', 512))
+		self.hedgeable = 0
+		self.hedged = 0
+		self.hedges_won = 0
+		self.session = requests.Session()
+		# buffered bodies are decoded to be cached and projected, and compressed
+		# again for the client, so they are fetched uncompressed; streamed calls
+		# ask for the client's encodings instead
+		self.session.headers['Accept-Encoding'] = 'identity'
+		self.adapter = HTTPAdapter(
+			pool_connections=self.pool_connections,
+			pool_maxsize=self.pool_maxsize,
+			pool_block=config.get('pool_block', False))
+		self.session.mount('http://', self.adapter)
+		self.session.mount('https://', self.adapter)
+
+	def pick(self, route_class, exclude=None):
+		"""
+		The available replica with the lowest ``Backend.score``, ties broken
+		at random. Raises UpstreamFailure when every circuit is open, or
+		returns None then if a replica to ``exclude`` is given.
+		"""
+		self.watch()
+		now = time.monotonic()
+		candidates = [backend for backend in self.backends if backend is not exclude and backend.breaker.available(now)]
+		random.shuffle(candidates)
+		for backend in sorted(candidates, key=Backend.score):
+			if backend.breaker.allow():
+				return backend
+		if exclude is not None:
+			return None
+		metrics.UPSTREAM_REJECTED.inc('circuit_open', route_class)
+		retry_after = min(backend.breaker.retryAfter() for backend in self.backends)
+		raise UpstreamFailure('Market Maker is unavailable, circuit open', 503, retry_after)
+
+	def request(self, method, path, **kwargs):
+		"""
+		Send a call through its route class bulkhead to the best available
+		replica, with the configured connect and read timeouts. Raises
+		UpstreamFailure when it is refused, times out or cannot connect.
+		"""
+		route_class = routeClass(method, path)
+		release = self.bulkheads.acquire(route_class)
+		try:
+			return self.dispatch(route_class, method, path, **kwargs)
+		finally:
+			release()
+
+	def stream(self, method, path, **kwargs):
+		"""
+		Open a streamed call like ``request`` does, returning the response
+		and the function that gives back its bulkhead slot. The slot stays
+		held while the body is relayed; pass the function to iterBody.
+		"""
+		route_class = routeClass(method, path)
+		release = self.bulkheads.acquire(route_class)
+		opened = False
+		try:
+			response = self.dispatch(route_class, method, path, stream=True, **kwargs)
+			opened = True
+			return response, release
+		finally:
+			if not opened:
+				release()
+
+	def dispatch(self, route_class, method, path, **kwargs):
+		if method == 'GET' and self.hedge and not kwargs.get('stream'):
+			return self.hedgedGet(route_class, path, **kwargs)
+		backend = self.pick(route_class)
+		try:
+			return self.send(backend, method, path, **kwargs)
+		except UpstreamFailure as e:
+			other = self.failover(method, route_class, backend, e)
+			if other is None:
+				raise
+			return self.send(other, method, path, **kwargs)
+
+	def failover(self, method, route_class, backend, e):
+		"""
+		Another replica to send a read to when ``backend`` could not be
+		reached, or None.
+		"""
+		if method not in READ_METHODS or e.status != 503 or len(self.backends) < 2:
+			return None
+		return self.pick(route_class, exclude=backend)
+
+	def hedgeDelay(self):
+		"""
+		How long a GET may go unanswered before it is hedged: the configured
+		percentile of recent response times. None while there are too few.
+		"""
+		with self.lock:
+			self.hedgeable += 1
+			if len(self.latencies) < self.hedge_samples:
+				return None
+			ordered = sorted(self.latencies)
+		return max(ordered[min(int(self.hedge_percentile * len(ordered)), len(ordered) - 1)], self.hedge_min_delay)
+
+	def pickHedge(self, route_class, primary):
+		"""
+		A second replica for a GET ``primary`` is slow to answer, or None if
+		there is none available or ``max_ratio`` of GETs are already hedged.
+		"""
+		with self.lock:
+			if self.hedged >= self.hedge_ratio * self.hedgeable:
+				return None
+		backend = self.pick(route_class, exclude=primary)
+		if backend is not None:
+			with self.lock:
+				self.hedged += 1
+		return backend
+
+	def hedgeWon(self):
+		with self.lock:
+			self.hedges_won += 1
+		metrics.UPSTREAM_HEDGES.inc('hedge')
+
+	def hedgedGet(self, route_class, path, **kwargs):
+		"""
+		GET ``path`` from the best replica and, if it has not answered well
+		after ``hedgeDelay``, from the next best as well. The first response that is
+		not a 5xx wins; the other call runs to completion and is dropped.
+		"""
+		primary = self.pick(route_class)
+		delay = self.hedgeDelay()
+		if delay is None:
+			return self.send(primary, 'GET', path, **kwargs)
+		started = time.perf_counter()
+		try:
+			# sent from the hedge threads, so their time is added once, below
+			first = self.hedge_executor.submit(self.send, primary, 'GET', path, **kwargs)
+			# a call that failed early is hedged at once
+			done, _ = wait([first], timeout=delay)
+			if done and first.exception() is None and first.result().status_code < 500:
+				return first.result()
+			backend = self.pickHedge(route_class, primary)
+			if backend is None:
+				return first.result()
+			second = self.hedge_executor.submit(self.send, backend, 'GET', path, **kwargs)
+			pending = set([first, second])
+			while pending:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					if future.exception() is None and future.result().status_code < 500:
+						if future is second:
+							self.hedgeWon()
+						else:
+							metrics.UPSTREAM_HEDGES.inc('primary')
+						return future.result()
+			return first.result()
+		finally:
+			metrics.addTiming('upstream', time.perf_counter() - started)
+
+	def send(self, backend, method, path, **kwargs):
+		resource = resourceOf(path)
+		kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+		backend.started()
+		started = time.perf_counter()
+		try:
+			response = self.session.request(method, backend.url + path, **kwargs)
+		except requests.exceptions.Timeout as e:
+			self.failed(backend, method, resource, started)
+			raise UpstreamFailure('Market Maker timed out: %s' % e.__class__.__name__, 504)
+		except requests.exceptions.ConnectionError as e:
+			self.failed(backend, method, resource, started)
+			raise UpstreamFailure('Market Maker is unreachable: %s' % e.__class__.__name__, 503)
+		except Exception:
+			self.failed(backend, method, resource, started)
+			raise
+		finally:
+			elapsed = time.perf_counter() - started
+			metrics.UPSTREAM_SECONDS.observe(elapsed, method, resource)
+			metrics.addTiming('upstream', elapsed)
+		self.responded(backend, elapsed, backend.breaker.healthy(response.status_code))
+		if response.status_code >= 500:
+			metrics.UPSTREAM_ERRORS.inc(method, resource)
+		return response
+
+	def responded(self, backend, elapsed, succeeded):
+		backend.finished(elapsed, succeeded)
+		with self.lock:
+			self.latencies.append(elapsed)
+
+	def failed(self, backend, method, resource, started):
+		self.responded(backend, time.perf_counter() - started, False)
+		metrics.UPSTREAM_ERRORS.inc(method, resource)
+
+	def watch(self):
+		"""
+		Start probing the replicas in the background, once.
+		"""
+		if self.checker is not None or not self.health_interval:
+			return
+		with self.lock:
+			if self.checker is None:
+				self.checker = threading.Thread(target=self._check, name='market-maker-health')
+				self.checker.daemon = True
+				self.checker.start()
+
+	def _check(self):
+		while True:
+			for backend in self.backends:
+				started = time.perf_counter()
+				try:
+					response = self.session.get(backend.url + self.health_path, timeout=(self.connect_timeout, self.read_timeout))
+					response.close()
+					succeeded = backend.breaker.healthy(response.status_code)
+				except requests.exceptions.RequestException:
+					succeeded = False
+				backend.observe(time.perf_counter() - started, succeeded)
+			time.sleep(self.health_interval)
+
+	def backendStats(self):
+		return [backend.stats() for backend in self.backends]
+
+	def hedgeStats(self):
+		with self.lock:
+			return {
+				"enabled": self.hedge,
+				"eligible": self.hedgeable,
+				"hedged": self.hedged,
+				"won": self.hedges_won
+			}
+
+	def poolStats(self):
+		"""
+		Connection reuse counters summed over the host pools of the session.
+		A miss is a request that had to open a new TCP connection.
+		"""
+		pools = self.adapter.poolmanager.pools
+		requests_made = 0
+		connections = 0
+		for key in pools.keys():
+			pool = pools.get(key)
+			if pool is None:
+				continue
+			requests_made += pool.num_requests
+			connections += pool.num_connections
+		return {
+			"hosts": len(pools),
+			"pool_connections": self.pool_connections,
+			"pool_maxsize": self.pool_maxsize,
+			"requests": requests_made,
+			"hits": max(requests_made - connections, 0),
+			"misses": connections
+		}
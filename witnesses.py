@@ -0,0 +1,207 @@
+import calendar
+import json
+import threading
+import time
+import requests
+import yaml
+
+# Witness node selection
+# Probes every witness node bos_mint is configured with and ranks the healthy
+# ones by round trip time, so MINT calls go to the fastest one and fail over
+# to the next when it stops answering or falls behind the chain.
+
+PROBE = {"jsonrpc": "2.0", "id": 1, "method": "call", "params": ["database", "get_dynamic_global_properties", []]}
+
+def connectionOf(bos_mint_config):
+	"""
+	The ``connection.<use>`` block of a parsed config-bos-mint.yaml.
+	"""
+	connection = bos_mint_config['connection']
+	return connection[connection['use']]
+
+def nodesOf(bos_mint_config_path):
+	"""
+	The node urls and ``num_retries`` bos_mint connects with, read from the
+	config-bos-mint.yaml at ``bos_mint_config_path``.
+	"""
+	with open(bos_mint_config_path, 'r') as stream:
+		connection = connectionOf(yaml.safe_load(stream))
+	urls = connection['node']
+	return ([urls] if isinstance(urls, str) else list(urls)), connection.get('num_retries', 1)
+
+def probe(url, timeout):
+	"""
+	Ask the node at ``url`` for its head block. Returns the round trip of
+	the call in seconds and the age of the head block in seconds.
+	"""
+	if url.startswith(('ws://', 'wss://')):
+		# comes with peerplays; imported here like bos_mint is
+		import websocket
+		connection = websocket.create_connection(url, timeout=timeout)
+		try:
+			started = time.perf_counter()
+			connection.send(json.dumps(PROBE))
+			reply = json.loads(connection.recv())
+			elapsed = time.perf_counter() - started
+		finally:
+			connection.close()
+	else:
+		started = time.perf_counter()
+		response = requests.post(url, json=PROBE, timeout=timeout)
+		elapsed = time.perf_counter() - started
+		reply = response.json()
+	if reply.get('error'):
+		raise ValueError(reply['error'].get('message', 'error') if isinstance(reply['error'], dict) else reply['error'])
+	head_time = calendar.timegm(time.strptime(reply['result']['time'], '%Y-%m-%dT%H:%M:%S'))
+	return elapsed, time.time() - head_time
+
+class _Witness(object):
+
+	def __init__(self, url):
+		self.url = url
+		self.healthy = None
+		self.latency = None
+		self.head_age = None
+		self.error = None
+		self.failures = 0
+
+class WitnessNodes(object):
+	"""
+	Ranks the ``connection.<use>.node`` list of the config-bos-mint.yaml at
+	``bos_mint_config`` by the round trip of a probe repeated every
+	``probe_interval`` seconds. A node is healthy when it answers within
+	``probe_timeout`` and its head block is at most ``max_head_age`` seconds
+	old. The file is read on the first probe, when MINT first connects.
+	"""
+
+	def __init__(self, bos_mint_config, config):
+		self.bos_mint_config = bos_mint_config
+		self.witnesses = []
+		self.num_retries = 1
+		self.loaded = False
+		self.probe_interval = config.get('probe_interval', 30)
+		self.probe_timeout = config.get('probe_timeout', 3)
+		self.max_head_age = config.get('max_head_age', 30)
+		self.decay = config.get('latency_decay', 0.3)
+		self.switch_margin = config.get('switch_margin', 0.2)
+		self.lock = threading.Lock()
+		self.thread = None
+		self.rounds = 0
+		self.switches = 0
+
+	def load(self):
+		with self.lock:
+			if self.loaded:
+				return
+			urls, self.num_retries = nodesOf(self.bos_mint_config)
+			self.witnesses = [_Witness(url) for url in urls]
+			self.loaded = True
+
+	def probeOne(self, witness):
+		try:
+			elapsed, head_age = probe(witness.url, self.probe_timeout)
+		except Exception as e:
+			with self.lock:
+				witness.healthy = False
+				witness.failures += 1
+				witness.error = '%s: %s' % (e.__class__.__name__, e)
+			return
+		with self.lock:
+			witness.latency = elapsed if witness.latency is None else witness.latency + self.decay * (elapsed - witness.latency)
+			witness.head_age = head_age
+			witness.healthy = head_age <= self.max_head_age
+			witness.error = None if witness.healthy else 'head block %d s old' % head_age
+
+	def probeAll(self):
+		"""
+		Probe every node at once and wait for the answers.
+		"""
+		self.load()
+		threads = [threading.Thread(target=self.probeOne, args=(witness,), name='witness-probe') for witness in self.witnesses]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			thread.join(self.probe_timeout * 2)
+		with self.lock:
+			self.rounds += 1
+
+	def ranked(self):
+		"""
+		Node urls best first: healthy nodes by round trip, then nodes not
+		probed yet, then unhealthy ones as a last resort.
+		"""
+		with self.lock:
+			order = {True: 0, None: 1, False: 2}
+			return [witness.url for witness in sorted(self.witnesses, key=lambda witness: (order[witness.healthy], witness.latency or 0.0))]
+
+	def better(self, url):
+		"""
+		Whether there is a node worth leaving ``url`` for: ``url`` is
+		unhealthy, or the best healthy node is faster by more than
+		``switch_margin``.
+		"""
+		with self.lock:
+			healthy = [witness for witness in self.witnesses if witness.healthy]
+			current = [witness for witness in self.witnesses if witness.url == url]
+		if not healthy:
+			return False
+		best = min(healthy, key=lambda witness: witness.latency)
+		if best.url == url:
+			return False
+		if not current or not current[0].healthy:
+			return True
+		return best.latency < current[0].latency * (1 - self.switch_margin)
+
+	def failed(self, url):
+		"""
+		Count a connection error on ``url`` against it until its next
+		successful probe.
+		"""
+		with self.lock:
+			for witness in self.witnesses:
+				if witness.url == url:
+					witness.healthy = False
+					witness.failures += 1
+					witness.error = 'connection error in a MINT call'
+
+	def switched(self):
+		with self.lock:
+			self.switches += 1
+
+	def start(self, on_round):
+		"""
+		Probe in the background every ``probe_interval`` seconds, calling
+		``on_round`` after each round. Starts once.
+		"""
+		with self.lock:
+			if self.thread is not None or not self.probe_interval:
+				return
+			self.thread = threading.Thread(target=self._run, args=(on_round,), name='witness-probes')
+			self.thread.daemon = True
+			self.thread.start()
+
+	def _run(self, on_round):
+		while True:
+			time.sleep(self.probe_interval)
+			self.probeAll()
+			try:
+				on_round()
+			except Exception:
+				# a failed switch is retried after the next round
+				pass
+
+	def stats(self):
+		with self.lock:
+			return {
+				"rounds": self.rounds,
+				"switches": self.switches,
+				"nodes": [{
+					"url": witness.url,
+					"healthy": witness.healthy,
+					"latency_ms": witness.latency * 1000 if witness.latency is not None else None,
+					"head_age_s": witness.head_age,
+					"failures": witness.failures,
+					"error": witness.error
+				} for witness in self.witnesses]
+			}
@@ -0,0 +1,8 @@
+from qaapi import create_app
+
+# WSGI entry point, e.g.
+#   uwsgi --ini uwsgi.ini
+#   gunicorn --workers 4 --threads 8 --bind 0.0.0.0:5050 wsgi:app
+# Each worker process loads config.yaml (or $QAAPI_CONFIG) and builds its own
+# Market Maker pool, caches and witness connection.
+app = create_app()